@@ -40,6 +40,7 @@ class Link(models.Model):
         verbose_name = _('link')
         verbose_name_plural = _('links')
         ordering = ['-link_type__importance']
+        index_together = [('content_type', 'object_pk', 'active')]
 
     def __unicode__(self):
         return "%s: %s" % (self.title, self.url)
@@ -0,0 +1,51 @@
+''' read replicas
+
+    `ReplicaRouter` sends the reads of the views in `REPLICA_VIEWS` to one of
+    the `DATABASE_REPLICAS`, everything else, all the writes included, goes
+    to the primary, 'default'. `oshot.middleware.ReplicaReads` decides per
+    request, and keeps a browser on the primary for `REPLICA_STICKY_SECONDS`
+    after it posted, so it reads its own writes.
+
+    the reads that decide a write, like `EntityStats.for_entity` creating the
+    counters it doesn't find, are made on the primary with `.using(PRIMARY)`
+    (`get_or_create` reads from where it writes anyway).
+'''
+import random
+import threading
+
+from django.conf import settings
+
+PRIMARY = 'default'
+# read from the primary even in the replica views
+PRIMARY_APPS = ('sessions', )
+
+_local = threading.local()
+
+def use_replicas(enabled):
+    ''' sends the reads of this thread to the replicas, or back to the primary '''
+    _local.replicas = enabled
+
+def using_replicas():
+    return getattr(_local, 'replicas', False) and bool(settings.DATABASE_REPLICAS)
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS or not using_replicas():
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the primary's rows
+        databases = [PRIMARY] + list(settings.DATABASE_REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
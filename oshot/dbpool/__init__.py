@@ -0,0 +1,186 @@
+''' a pool of persistent postgresql connections
+
+    a database with the 'oshot.dbpool' ENGINE keeps its connections open
+    between requests. django closes the connections when a request finishes,
+    and the pool's `DatabaseWrapper` (see `base.py`) puts them back in the
+    pool instead, rolled back, for the next request of the same process.
+
+    the pool of every database is configured by its 'POOL' settings, see
+    `POOL_DEFAULTS`. a process holds at most 'SIZE' connections per
+    database, so the workers times 'SIZE' bounds the connections postgresql
+    gets. a connection is closed after 'MAX_LIFETIME' seconds, and one that
+    was idle for more than 'CHECK_AFTER' seconds is checked before it's used.
+
+    the time requests waited for a connection is recorded by
+    `oshot.middleware.RequestStats`, and `stats()` has the pools' counters.
+'''
+import os
+import threading
+import time
+from collections import defaultdict
+
+POOL_DEFAULTS = {
+    'SIZE': 4,
+    # seconds to wait for a connection when all of them are in use
+    'TIMEOUT': 10,
+    'MAX_LIFETIME': 3600,
+    'CHECK_AFTER': 30,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = self.used_at = time.time()
+
+
+class ConnectionPool(object):
+    ''' the idle connections of a database in this process, and the number
+        of connections in use '''
+    def __init__(self, size, timeout, max_lifetime, check_after):
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.idle = []
+        self.in_use = 0
+        self.condition = threading.Condition()
+        self.counters = defaultdict(int)
+        self.pid = os.getpid()
+        # the connections of the parent process, see `reset_after_fork`
+        self.inherited = []
+
+    def count(self, counter, n=1):
+        with self.condition:
+            self.counters[counter] += n
+
+    def reset_after_fork(self):
+        if self.pid != os.getpid():
+            # closing them would close the parent's, so they're kept
+            # referenced and never used
+            self.inherited += [pooled.connection for pooled in self.idle]
+            self.idle, self.in_use = [], 0
+            self.counters.clear()
+            self.pid = os.getpid()
+
+    def checkout(self):
+        ''' reserves a connection and returns an idle one that's fit for use,
+            or None if a new one should be connected and `add`ed '''
+        start = time.time()
+        with self.condition:
+            self.reset_after_fork()
+            while self.in_use >= self.size:
+                remaining = start + self.timeout - time.time()
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout("all the %d connections are in use" %
+                                      self.size)
+                self.condition.wait(remaining)
+            self.in_use += 1
+            waited = time.time() - start
+            self.counters['checkouts'] += 1
+            self.counters['wait_ms'] += int(waited * 1000)
+            self.counters['max_wait_ms'] = max(self.counters['max_wait_ms'],
+                                               int(waited * 1000))
+        _local.wait_time = getattr(_local, 'wait_time', 0) + waited
+
+        while True:
+            with self.condition:
+                if not self.idle:
+                    return None
+                # the most recently used one is the least likely to be stale
+                pooled = self.idle.pop()
+            if self.is_fit(pooled):
+                self.count('reused')
+                return pooled
+            self.close(pooled)
+
+    def add(self, connection):
+        ''' returns the new connection the caller reserved, as pooled '''
+        self.count('connected')
+        return PooledConnection(connection)
+
+    def checkin(self, pooled, reuse=True):
+        ''' gives back the reserved connection, or just the reservation if
+            `pooled` is None '''
+        if pooled is not None:
+            if reuse and not pooled.connection.closed and \
+                    time.time() - pooled.created_at < self.max_lifetime:
+                pooled.used_at = time.time()
+            else:
+                self.close(pooled)
+                pooled = None
+        with self.condition:
+            if pooled is not None:
+                self.idle.append(pooled)
+            self.in_use = max(0, self.in_use - 1)
+            self.condition.notify()
+
+    def is_fit(self, pooled):
+        now = time.time()
+        if pooled.connection.closed or \
+                now - pooled.created_at >= self.max_lifetime:
+            return False
+        if now - pooled.used_at >= self.check_after:
+            self.count('checks')
+            try:
+                cursor = pooled.connection.cursor()
+                cursor.execute('SELECT 1')
+                cursor.close()
+                pooled.connection.rollback()
+            except Exception:
+                return False
+        return True
+
+    def close(self, pooled):
+        self.count('closed')
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+
+    def close_idle(self):
+        ''' closes the idle connections, e.g. before the database is dropped '''
+        with self.condition:
+            idle, self.idle = self.idle, []
+        for pooled in idle:
+            self.close(pooled)
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.counters)
+            stats.update(size=self.size, in_use=self.in_use, idle=len(self.idle))
+        return stats
+
+
+def get_pool(key, options):
+    ''' returns the pool of `key`, the alias and the connection settings of
+        a database '''
+    with _pools_lock:
+        if key not in _pools:
+            options = dict(POOL_DEFAULTS, **options)
+            _pools[key] = ConnectionPool(size=options['SIZE'],
+                    timeout=options['TIMEOUT'],
+                    max_lifetime=options['MAX_LIFETIME'],
+                    check_after=options['CHECK_AFTER'])
+        return _pools[key]
+
+def stats():
+    ''' returns the counters of the pools of this process, per database '''
+    return dict(('%s (%s)' % (key[0], key[1]), pool.stats())
+                for key, pool in _pools.items())
+
+def take_wait_time():
+    ''' returns the seconds this thread waited for connections since the
+        last call '''
+    wait_time = getattr(_local, 'wait_time', 0)
+    _local.wait_time = 0
+    return wait_time
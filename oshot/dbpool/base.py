@@ -0,0 +1,59 @@
+''' the postgresql backend, with its connections kept in `oshot.dbpool` '''
+from django.db.backends.postgresql_psycopg2.base import DatabaseWrapper as \
+    PostgresDatabaseWrapper, Database
+
+from oshot.dbpool import get_pool
+from oshot.dbpool.creation import DatabaseCreation
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.creation = DatabaseCreation(self)
+        self.pool, self.pooled = None, None
+
+    def get_pool(self):
+        # the test runner switches the NAME of the database it connects to
+        key = tuple(self.settings_dict[k] for k in
+                    ('NAME', 'USER', 'HOST', 'PORT'))
+        return get_pool((self.alias, ) + key, self.settings_dict.get('POOL', {}))
+
+    def _cursor(self):
+        if self.connection is None:
+            self.pool = self.get_pool()
+            self.pooled = self.pool.checkout()
+            if self.pooled is None:
+                try:
+                    cursor = super(DatabaseWrapper, self)._cursor()
+                except Exception:
+                    self.pool.checkin(None)
+                    raise
+                self.pooled = self.pool.add(self.connection)
+                return cursor
+            self.connection = self.pooled.connection
+            try:
+                # the wrapper that used it last might have had another level
+                self.connection.set_isolation_level(self.isolation_level)
+            except Database.Error:
+                self.pool.checkin(self.pooled, reuse=False)
+                self.pooled, self.connection = None, None
+                raise
+        return super(DatabaseWrapper, self)._cursor()
+
+    def close(self, really=False):
+        ''' puts the connection back in the pool, or closes it if `really`
+            or if it's no longer to the configured database '''
+        self.validate_thread_sharing()
+        if self.pooled is None:
+            return super(DatabaseWrapper, self).close()
+        pooled, self.pooled, self.connection = self.pooled, None, None
+        if really or self.pool is not self.get_pool():
+            self.pool.checkin(pooled, reuse=False)
+            return
+        try:
+            # the next request starts with a clean connection
+            pooled.connection.rollback()
+            reuse = True
+        except Database.Error:
+            reuse = False
+        self.pool.checkin(pooled, reuse)
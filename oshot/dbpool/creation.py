@@ -0,0 +1,11 @@
+from django.db.backends.postgresql_psycopg2.creation import DatabaseCreation as \
+    PostgresDatabaseCreation
+
+
+class DatabaseCreation(PostgresDatabaseCreation):
+    def destroy_test_db(self, old_database_name, verbosity=1):
+        # postgresql won't drop the test database while it has connections
+        self.connection.close(really=True)
+        self.connection.get_pool().close_idle()
+        super(DatabaseCreation, self).destroy_test_db(old_database_name,
+                                                      verbosity)
@@ -1,9 +1,27 @@
+import time
+import logging
+import threading
+from collections import deque, defaultdict
+
 from django.http import HttpResponseRedirect
 from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.db.backends import BaseDatabaseWrapper
 from django.db.models import Count
+from django.core.cache import cache
+from django.template.base import Template
 
 from entities.models import Entity
+from oshot import dbpool
+from oshot.db import use_replicas
+
+logger = logging.getLogger(__name__)
+
+def view_name(view_func):
+    ''' returns the dotted name of the view, the class's for callable
+        instances like the feeds '''
+    name = getattr(view_func, '__name__', view_func.__class__.__name__)
+    return "%s.%s" % (view_func.__module__, name)
 
 class DefaultEntity(object):
     def process_request(self, request):
@@ -20,3 +38,191 @@ class DefaultEntity(object):
             if entity:
                 return HttpResponseRedirect(reverse('entity_home', kwargs={
                                 'entity_id': entity.id}))
+
+
+''' request stats
+
+    `RequestStats` records, per view, the number of queries, the time spent
+    in the db, waiting for a pooled db connection (see `oshot.dbpool`), in
+    rendering templates and in total, and the cache hits and misses of every
+    request. the last `REQUEST_STATS_WINDOW` requests of
+    every view are kept in-process, and summed up by `request_stats`.
+
+    the queries of all the databases are counted and timed by a thin wrapper
+    of the cursors, the debug cursor would format and keep every query.
+'''
+SAMPLE_FIELDS = ('queries', 'db_ms', 'db_wait_ms', 'template_ms', 'total_ms',
+                 'cache_hits', 'cache_misses')
+
+# {view name: deque of samples}
+samples = defaultdict(lambda: deque(maxlen=settings.REQUEST_STATS_WINDOW))
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def _timed_render(render):
+    def wrapper(self, context):
+        # included templates are rendered inside their parent's time
+        if getattr(_local, 'rendering', False):
+            return render(self, context)
+        _local.rendering = True
+        start = time.time()
+        try:
+            return render(self, context)
+        finally:
+            _local.rendering = False
+            if hasattr(_local, 'template_time'):
+                _local.template_time += time.time() - start
+    return wrapper
+
+def _counted_get(get):
+    def wrapper(*args, **kwargs):
+        value = get(*args, **kwargs)
+        if hasattr(_local, 'cache_hits'):
+            if value is None:
+                _local.cache_misses += 1
+            else:
+                _local.cache_hits += 1
+        return value
+    return wrapper
+
+class _TimedCursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def _timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            if hasattr(_local, 'queries'):
+                _local.queries += 1
+                _local.db_time += time.time() - start
+
+    def execute(self, sql, params=()):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+def _timed_cursor(cursor):
+    def wrapper(self):
+        if hasattr(_local, 'queries'):
+            return _TimedCursor(cursor(self))
+        return cursor(self)
+    return wrapper
+
+def _install_hooks():
+    if getattr(Template.render, 'request_stats', False):
+        return
+    Template.render = _timed_render(Template.render)
+    Template.render.request_stats = True
+    cache.get = _counted_get(cache.get)
+    BaseDatabaseWrapper.cursor = _timed_cursor(BaseDatabaseWrapper.cursor)
+
+def _start_counting():
+    _local.queries, _local.db_time, _local.template_time = 0, 0, 0
+    _local.cache_hits = _local.cache_misses = 0
+    dbpool.take_wait_time()
+
+def _stop_counting():
+    ''' returns the counts of the request, leaving the hooks idle until the
+        next one '''
+    counts = (_local.queries, _local.db_time, dbpool.take_wait_time(),
+              _local.template_time, _local.cache_hits, _local.cache_misses)
+    for name in ('queries', 'db_time', 'template_time', 'cache_hits',
+                 'cache_misses'):
+        delattr(_local, name)
+    return counts
+
+def summarize():
+    ''' returns {view: {field: {count, mean, p50, p95, max}}} of the samples '''
+    summary = {}
+    for view, view_samples in samples.items():
+        view_samples = list(view_samples)
+        summary[view] = {}
+        for i, field in enumerate(SAMPLE_FIELDS):
+            values = sorted(s[i] for s in view_samples)
+            if not values:
+                continue
+            summary[view][field] = {
+                'count': len(values),
+                'mean': sum(values) / float(len(values)),
+                'p50': values[len(values) / 2],
+                'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+                'max': values[-1],
+            }
+    return summary
+
+
+class RequestStats(object):
+    def __init__(self):
+        _install_hooks()
+
+    def process_request(self, request):
+        request._stats_start = time.time()
+        _start_counting()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._stats_view = view_name(view_func)
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_stats_start') or \
+                not hasattr(_local, 'queries'):
+            return response
+        queries, db_time, wait_time, template_time, cache_hits, cache_misses = \
+                _stop_counting()
+        view = getattr(request, '_stats_view', None)
+        if view is None:
+            return response
+        sample = (queries,
+                  db_time * 1000,
+                  wait_time * 1000,
+                  template_time * 1000,
+                  (time.time() - request._stats_start) * 1000,
+                  cache_hits,
+                  cache_misses)
+        samples[view].append(sample)
+
+        budget = settings.VIEW_QUERY_BUDGETS.get(view)
+        if budget is not None and queries > budget:
+            message = "%s ran %d queries, over its budget of %d" % \
+                        (view, queries, budget)
+            if settings.QUERY_BUDGETS_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class ReplicaReads(object):
+    ''' reads the GETs of `REPLICA_VIEWS` from the replicas (see `oshot.db`),
+        unless the browser posted in the last `REPLICA_STICKY_SECONDS` '''
+    cookie_name = 'read_primary'
+
+    def process_request(self, request):
+        use_replicas(False)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in ('GET', 'HEAD') and \
+                not self.cookie_name in request.COOKIES and \
+                view_name(view_func) in settings.REPLICA_VIEWS:
+            use_replicas(True)
+
+    def process_exception(self, request, exception):
+        use_replicas(False)
+
+    def process_response(self, request, response):
+        use_replicas(False)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            response.set_cookie(self.cookie_name, '1',
+                                max_age=settings.REPLICA_STICKY_SECONDS)
+        return response
@@ -66,6 +66,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'oshot.middleware.RequestStats',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,6 +75,7 @@ MIDDLEWARE_CLASSES = (
     'bootstrap_pagination.middleware.PaginationMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'oshot.middleware.DefaultEntity',
+    'oshot.middleware.ReplicaReads',
 )
 
 ROOT_URLCONF = 'oshot.urls'
@@ -224,6 +226,12 @@ HAYSTACK_CONNECTIONS = {
         'ENGINE': 'haystack.backends.whoosh_backend.WhooshEngine',
         'PATH': os.path.join(PROJECT_DIR, 'whoosh_index'),
     },
+    # the local sqlite index of `qa.fts`, only the default connection is kept
+    # up to date, so make this the default to serve the searches from it
+    'fts': {
+        'ENGINE': 'qa.fts.SQLiteFTSEngine',
+        'PATH': os.path.join(PROJECT_DIR, 'fts_index.sqlite3'),
+    },
 }
 AUTO_GENERATE_AVATAR_SIZES = (75, 48)
 ABSOLUTE_URL_OVERRIDES = {
@@ -243,4 +251,50 @@ CACHES = {
         }
 
 LONG_CACHE_TIME = 18000  # 5 hours
+# the number of question ids cached per list of an entity, the pages past
+# them are read from the db
+CACHED_QUESTION_IDS = 1000
 MIN_EDITORS_PER_LOCALITY = 3
+# the CBS locality stats the `load_cbs_stats` command loads by default
+CBS_STATS_FILE = STATICFILES_ROOT.child('js', 'entity_stats.js')
+# new answer notifications are sent in chunks of this many recipients
+ANSWER_EMAIL_BATCH_SIZE = 50
+# per worker limit of the calls to facebook's graph api, in celery's format
+FACEBOOK_RATE_LIMIT = '30/m'
+# the seconds the search index changes are batched for, see qa.indexing. the
+# batching needs a shared cache, like memcached
+SEARCH_INDEX_WINDOW = 10
+# the seconds a place search is cached for, if its index doesn't change
+SEARCH_CACHE_TIME = 600
+# the number of requests per view kept by oshot.middleware.RequestStats
+REQUEST_STATS_WINDOW = 1000
+# the most queries a view may run, the strict mode raises instead of warning
+VIEW_QUERY_BUDGETS = {
+    'qa.views.entity_home': 25,
+    'qa.views.QuestionDetail': 25,
+    'user.views.public_profile': 30,
+    'polyorg.views.candidates_list': 30,
+}
+QUERY_BUDGETS_STRICT = False
+# the databases that replicate 'default', see oshot.db. in tests they should
+# set 'TEST_MIRROR': 'default'
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['oshot.db.ReplicaRouter']
+# the views whose GETs read from the replicas, the rest use the primary
+REPLICA_VIEWS = (
+    'qa.views.entity_home',
+    'qa.views.QuestionDetail',
+    'qa.views.RssQuestionFeed',
+    'qa.views.AtomQuestionFeed',
+    'qa.views.RssQuestionAnswerFeed',
+    'qa.views.AtomQuestionAnswerFeed',
+    'user.feeds.AtomUserAnswerFeed',
+    'qa.sitemaps.index',
+    'qa.sitemaps.sitemap',
+    'user.views.public_profile',
+    'polyorg.views.candidates_list',
+)
+# the seconds a browser reads from the primary after it posted
+REPLICA_STICKY_SECONDS = 10
+# the seconds a value read from a replica is cached, about the replicas' lag
+REPLICA_CACHE_TIME = 10
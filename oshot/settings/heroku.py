@@ -13,6 +13,15 @@ DEBUG = os.environ.get('DEBUG', False)
 TEMPLATE_DEBUG = DEBUG
 
 DATABASES = { 'default': dj_database_url.config() }
+if 'REPLICA_DATABASE_URL' in environ:
+    DATABASES['replica'] = dj_database_url.config('REPLICA_DATABASE_URL')
+    DATABASES['replica']['TEST_MIRROR'] = 'default'
+    DATABASE_REPLICAS = ['replica']
+# persistent connections, see oshot.dbpool
+for database in DATABASES.values():
+    database['ENGINE'] = 'oshot.dbpool'
+SOUTH_DATABASE_ADAPTERS = dict((alias, 'south.db.postgresql_psycopg2')
+                               for alias in DATABASES)
 
 EMAIL_HOST_USER = os.environ['SENDGRID_USERNAME']
 EMAIL_HOST= 'smtp.sendgrid.net'
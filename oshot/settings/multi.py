@@ -1,6 +1,6 @@
 import djcelery
 
 djcelery.setup_loader()
-HAYSTACK_SIGNAL_PROCESSOR = 'celery_haystack.signals.CelerySignalProcessor'
+HAYSTACK_SIGNAL_PROCESSOR = 'qa.indexing.BatchedSignalProcessor'
 EMAIL_BACKEND = 'djcelery_email.backends.CeleryEmailBackend'
 
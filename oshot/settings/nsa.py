@@ -11,14 +11,22 @@ TEMPLATE_DEBUG = DEBUG
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2', # Add 'postgresql_psycopg2', 'postgresql', 'mysql', 'sqlite3' or 'oracle'.
+        # postgresql_psycopg2 with persistent connections, see oshot.dbpool
+        'ENGINE': 'oshot.dbpool',
         'NAME': 'oshot',                      # Or path to database file if using sqlite3.
         'USER': 'oshot',                      # Not used with sqlite3.
         'PASSWORD': 'oshot',                  # Not used with sqlite3.
         'HOST': '',                      # Set to empty string for localhost. Not used with sqlite3.
         'PORT': '',                      # Set to empty string for default. Not used with sqlite3.
+        'POOL': {'SIZE': 4, 'MAX_LIFETIME': 3600},
     }
 }
+if os.environ.get('DATABASE_REPLICA_HOST'):
+    DATABASES['replica'] = dict(DATABASES['default'], TEST_MIRROR='default',
+                                HOST=os.environ['DATABASE_REPLICA_HOST'])
+    DATABASE_REPLICAS = ['replica']
+SOUTH_DATABASE_ADAPTERS = dict((alias, 'south.db.postgresql_psycopg2')
+                               for alias in DATABASES)
 
 EMAIL_HOST = 'localhost'
 EMAIL_PORT = 25
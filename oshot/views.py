@@ -1,10 +1,13 @@
 # encoding: utf-8
+import json
+from functools import partial
+
 # Django imports
 from django.shortcuts import render, render_to_response
 from django.utils.translation import ugettext as _
-from django.db.models import Count
+from django.db.models import Count, Sum
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseForbidden, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect
 from django.template.context import RequestContext
 from django.core.urlresolvers import reverse
 
@@ -14,8 +17,11 @@ from haystack.inputs import Exact
 from haystack.views import basic_search
 from entities.models import Entity
 # our apps
-from qa.models import Answer, Question
+from qa.models import Answer, Question, EntityStats
+from qa.search import PlaceSearchForm
 from user.models import Profile
+from oshot.middleware import summarize
+from oshot import dbpool
 
 def place_search(request, entity_slug=None):
     """ A view to search in a specific place """
@@ -23,7 +29,9 @@ def place_search(request, entity_slug=None):
         searchqs = SearchQuerySet().filter(place=Exact(entity_slug))
     else:
         searchqs = SearchQuerySet().exclude(place=Exact(u"אא-מעלה-אבק"))
-    return basic_search(request, searchqueryset=searchqs)
+    # the cached results are loaded by the form, in bulk
+    return basic_search(request, searchqueryset=searchqs, load_all=False,
+            form_class=partial(PlaceSearchForm, place=entity_slug or u''))
 
 @login_required
 def entity_stats(request):
@@ -45,10 +53,25 @@ def entity_stats(request):
                             'answer_count': answer_count,
                             })
 
+@login_required
+def request_stats(request):
+    ''' the per view stats recorded by `oshot.middleware.RequestStats` and
+        the counters of the db connection pools, in this process '''
+    if not request.user.is_superuser:
+        return HttpResponseForbidden(_('Only superusers have access to this page.'))
+    stats = {'views': summarize(), 'db_pools': dbpool.stats()}
+    return HttpResponse(json.dumps(stats, indent=2),
+                        content_type='application/json')
+
 def home_page(request):
+    totals = EntityStats.objects.aggregate(questions=Sum('questions_count'),
+                                           answers=Sum('answers_count'))
+    # the questions without an entity have no stats to count them
+    questions = Question.objects.filter(entity=None, is_deleted=False)
+    answers = Answer.objects.filter(question__in=questions, is_deleted=False)
     context = RequestContext(request, {
-        'questions': Question.objects.count(),
-        'answers': Answer.objects.count(),
+        'questions': (totals['questions'] or 0) + questions.count(),
+        'answers': (totals['answers'] or 0) + answers.count(),
         })
     return render_to_response('home_page.html', context)
 
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 import random
+import sys
+import time
+from optparse import make_option
 
 from django.core.management.base import BaseCommand
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 
 from user.models import User, Membership
+from user.bulk import chunked, hash_passwords, bulk_create_users,\
+    refresh_entities
 from polyorg.models import CandidateList, Candidate
 from entities.models import Entity
 
@@ -14,47 +19,78 @@ from user.management.commands import ucsv as csv
 
 class Command(BaseCommand):
     args = '<list_file>'
-    help = 'import lists from a csv file'
-
+    help = 'import candidates from a csv file'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=500,
+            help='number of rows to insert at once'),
+        make_option('--processes', type='int', dest='processes', default=None,
+            help='number of processes hashing the passwords, default is a process per core'),
+    )
+
+    @transaction.commit_on_success
     def handle(self, *args, **options):
+        start = time.time()
         file_name = args[0]
         f = open(file_name, 'rb')
         d = csv.DictReader(f)
-        i = 1
-        for row in d:
-            ordinal = int(row['ordinal'])
-            locality_name = row['locality']
-            ballot = row['ballot']
-            mayor = bool(row['mayor'])
-            
-            fullname = row['name']
-
-            locality = Entity.objects.filter(division__index=3).get(name_he=locality_name)
-            candidatelist = locality.candidatelist_set.get(ballot=ballot)
-
-            last_name, first_name = fullname.split(' ', 1)
-            username = u'c_%04d' % i
-
-            user = User(
-                username=username,
-                first_name=first_name,
-                last_name=last_name,
-            )
-
-            password = random.randint(1,99999)
-            s = u'%s, %s, %s, %s, %s' % (locality_name, first_name, last_name, username, password)
-            print s.encode('utf-8')
-            user.set_password(password)
-            user.save()
-
-            Membership.objects.create(profile=user.profile, entity=locality)
-            user.profile.verification = u'V'
-
-            user.profile.save()
-
-            candidate = Candidate(candidate_list=candidatelist, user=user,
-                            ordinal=ordinal, for_mayor=mayor)
-            candidate.save()
-
-            i += 1
 
+        # resolve all the localities and lists up front
+        localities = dict(Entity.objects.filter(division__index=3).\
+                            values_list('name_he', 'id'))
+        lists = dict(((entity_id, ballot), list_id) for list_id, entity_id, ballot in
+                        CandidateList.objects.values_list('id', 'entity', 'ballot'))
+
+        i = User.objects.filter(username__startswith='c_').count() + 1
+        count = 0
+        entity_ids = set()
+        for rows in chunked(d, options['batch_size']):
+            users, candidates = [], []
+            for row in rows:
+                locality_name = row['locality']
+                try:
+                    locality_id = localities[locality_name]
+                    list_id = lists[(locality_id, unicode(row['ballot']))]
+                except KeyError:
+                    sys.stderr.write((u'no list %s in %s, skipping %s\n' % \
+                            (row['ballot'], locality_name, row['name'])).encode('utf-8'))
+                    continue
+
+                last_name, first_name = row['name'].split(' ', 1)
+                username = u'c_%04d' % i
+                password = random.randint(1,99999)
+                s = u'%s, %s, %s, %s, %s' % (locality_name, first_name, last_name, username, password)
+                print s.encode('utf-8')
+
+                users.append(User(
+                    username=username,
+                    first_name=first_name,
+                    last_name=last_name,
+                    password=password,
+                ))
+                candidates.append((username, locality_id, list_id,
+                                   int(row['ordinal']), bool(row['mayor'])))
+                entity_ids.add(locality_id)
+                i += 1
+
+            for user, hashed in zip(users,
+                    hash_passwords([u.password for u in users], options['processes'])):
+                user.password = hashed
+            user_ids = bulk_create_users(users, verification=u'V')
+
+            Membership.objects.bulk_create([Membership(user_id=user_ids[name],
+                    entity_id=entity_id, can_answer=True,
+                    member_of_id=candidate_list_id, is_special=mayor)
+                for name, entity_id, candidate_list_id, ordinal, mayor in candidates])
+            Candidate.objects.bulk_create([Candidate(user_id=user_ids[name],
+                    candidate_list_id=candidate_list_id, ordinal=ordinal,
+                    for_mayor=mayor)
+                for name, entity_id, candidate_list_id, ordinal, mayor in candidates])
+
+            count += len(candidates)
+            self.stdout.write('> %d candidates imported\n' % count)
+
+        refresh_entities(entity_ids)
+
+        elapsed = time.time() - start
+        self.stdout.write('> imported %d candidates in %.1f seconds, %.0f rows/second\n' % \
+                (count, elapsed, count / elapsed if elapsed else 0))
@@ -38,8 +38,8 @@ class Command(BaseCommand):
             clist = ls[0]
         else:
             clist = CandidateList.objects.create(name = cnd.list, ballot = cnd.ballot)
-        youtube_type, _  = LinkType.objects.get_or_create(title='YouTube')
-        default_type, _  = LinkType.objects.get_or_create(title='default')
+        youtube_type = self.link_types['YouTube']
+        default_type = self.link_types['default']
         self._add_link_if_changed(cnd, clist, 'party_youtube', link_title='סרטון YouTube של הרשימה',
                                   link_type=youtube_type, model_name='candidatelist')
         self._add_link_if_changed(cnd, clist, 'party_manifest_url', link_title='מצע הרשימה',
@@ -65,8 +65,18 @@ class Command(BaseCommand):
                 person.mk_id = mk_id
             person.save()
 
+    def _get_link_types(self, *titles):
+        ''' returns a {title: LinkType} map, creating missing types '''
+        link_types = {}
+        for title in titles:
+            link_types[title], _ = LinkType.objects.get_or_create(title=title)
+        return link_types
+
     @transaction.commit_on_success()
     def handle(self, *args, **options):
+        # resolve the link types once, not for every row
+        self.link_types = self._get_link_types('YouTube', 'default',
+                                               'ויקיפדיה', 'פייסבוק')
         # For each candidate:
         #    Build a Candidate object
         for csv_file in args:
@@ -80,11 +90,11 @@ class Command(BaseCommand):
                 else:
                     candidate = Candidate.objects.create(candidates_list = clist, person = person, ordinal = cnd.ordinal)
                 # update candidate fields, if changed
-                wiki_type, _  = LinkType.objects.get_or_create(title='ויקיפדיה')
+                wiki_type = self.link_types['ויקיפדיה']
                 self._add_link_if_changed(cnd, person, 'candidate_wikipedia',
                                           link_title='ויקיפדיה',
                                           link_type=wiki_type, model_name='person')
-                facebook_type, _  = LinkType.objects.get_or_create(title='פייסבוק')
+                facebook_type = self.link_types['פייסבוק']
                 self._add_link_if_changed(cnd, person, 'facebook', link_title='פייסבוק',
                                           link_type=facebook_type, model_name='person')
                 person.img_url = cnd.image_url
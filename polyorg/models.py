@@ -17,6 +17,8 @@ class CandidateList(models.Model):
     facebook_url = models.URLField(_('Facebook URL'), blank=True, null=True)
     platform = models.TextField(_('Platform'), blank=True, null=True)
     entity = models.ForeignKey('entities.Entity', blank=True, null=True)
+    # maintained by `qa.leaderboard`
+    answers_count = models.IntegerField(default=0)
 
     def save(self, *args, **kwargs):
         super(CandidateList, self).save()
@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 """
 This file demonstrates writing tests using the unittest module. These will pass
 when you run "manage.py test".
@@ -5,8 +6,13 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import tempfile
+
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from entities.models import Domain, Division, Entity
+from user.models import Membership
 from models import Candidate, CandidateList
 
 
@@ -32,6 +38,24 @@ class CreationTest(TestCase):
         self.assertFalse(cl1.get_candidates())
         cl1.delete()
 
+    def test_add_candidates(self):
+        domain = Domain.objects.create(name="test")
+        division = Division.objects.create(name="localities", domain=domain, index=3)
+        home = Entity.objects.create(name="earth", name_he=u"ארץ", division=division)
+        cl = CandidateList.objects.create(name="Imagine", ballot="I", entity=home)
+        csv_file = tempfile.NamedTemporaryFile()
+        csv_file.write(u"ordinal,locality,ballot,mayor,name\n"
+                       u"1,ארץ,I,1,Lennon John\n"
+                       u"2,ארץ,I,,McCartney Paul\n"
+                       u"1,ירח,I,,Starr Ringo\n".encode('utf-8'))
+        csv_file.flush()
+        call_command('add_candidates', csv_file.name, processes=1)
+        self.assertEquals(Candidate.objects.filter(candidate_list=cl).count(), 2)
+        john = User.objects.get(first_name="John")
+        self.assertEquals(john.profile.verification, u'V')
+        self.assertTrue(john.profile.is_special(home))
+        self.assertEquals(Membership.objects.get(user__first_name="Paul").member_of, cl)
+
     def teardown(self):
         for u in self.users: u.delete()
 
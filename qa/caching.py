@@ -0,0 +1,149 @@
+''' versioned caching of the entity pages' fragments
+
+    every entity has a version stamp kept in the cache. fragments are cached
+    under keys that include the stamp, so bumping it (from the signals in
+    `qa.signals`) invalidates all of the entity's fragments at once. the
+    question pages' fragments are versioned the same way, per question, and
+    the cached searches per place.
+
+    a fragment built from a replica (see `oshot.db`) might miss the writes
+    that bumped the version, so it's cached apart from the ones built from
+    the primary, which the browsers that just posted read, and only for
+    `REPLICA_CACHE_TIME`.
+'''
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+
+from oshot.db import using_replicas
+
+entity_version_key = lambda entity_id: "entity_version_%s" % entity_id
+question_version_key = lambda question_id: "question_version_%s" % question_id
+
+def new_version():
+    # a time based stamp never repeats, even if the old one was evicted
+    return '%x' % int(time.time() * 1000000)
+
+def get_version(key):
+    ''' returns the version stamp kept under `key`, starting a new one if
+        there is none '''
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        if not cache.add(key, version, settings.LONG_CACHE_TIME):
+            version = cache.get(key, version)
+    return version
+
+def cache_time():
+    ''' returns the seconds to cache a value built by this request '''
+    if using_replicas():
+        return settings.REPLICA_CACHE_TIME
+    return settings.LONG_CACHE_TIME
+
+def fragment_version(version):
+    ''' returns the version stamp a fragment built by this request is
+        cached under '''
+    return '%s_replica' % version if using_replicas() else version
+
+def entity_version(entity_id):
+    ''' returns the current version stamp of the entity '''
+    return get_version(entity_version_key(entity_id))
+
+def bump_entity_version(entity_id):
+    ''' invalidates all the cached fragments of the entity '''
+    cache.set(entity_version_key(entity_id), new_version(),
+              settings.LONG_CACHE_TIME)
+
+def question_version(question_id):
+    ''' returns the current version stamp of the question's answers and
+        supporters, the fragments of its page '''
+    return get_version(question_version_key(question_id))
+
+def bump_question_version(question_id):
+    ''' invalidates the cached fragments of the question's page '''
+    cache.set(question_version_key(question_id), new_version(),
+              settings.LONG_CACHE_TIME)
+
+def sitemap_version():
+    ''' returns the current version stamp of the sitemap index '''
+    return get_version('sitemap_version')
+
+def bump_sitemap_version():
+    ''' invalidates the cached sitemap index '''
+    cache.set('sitemap_version', new_version(), settings.LONG_CACHE_TIME)
+
+def search_version(place=u''):
+    ''' returns the current version stamp of the cached searches in the
+        place, an entity slug, or in all the places if it's empty '''
+    return '%s_%s' % (get_version('search_version'),
+        get_version('search_version_%s' % hashlib.md5(smart_str(place)).hexdigest()))
+
+def bump_search_version(place=None):
+    ''' invalidates the cached searches in the place, and in all the places
+        together. without a place, invalidates all the cached searches '''
+    if place is None:
+        keys = ['search_version']
+    else:
+        keys = ['search_version_%s' % hashlib.md5(smart_str(p)).hexdigest()
+                for p in (place, u'')]
+    cache.set_many(dict((key, new_version()) for key in keys),
+                   settings.LONG_CACHE_TIME)
+
+def entity_fragment(entity_id, name, builder):
+    ''' returns the fragment `name` of the entity, calling `builder` to
+        create it if it's not in the cache '''
+    key = "entity_%s_%s_%s" % (entity_id,
+                               fragment_version(entity_version(entity_id)), name)
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        cache.set(key, value, cache_time())
+    return value
+
+
+class CachedIdList(object):
+    ''' a lazy list of model objects, backed by a (cached) list of ids.
+
+        quacks enough like a queryset for the templates and the paginator,
+        only the objects of the requested slice are loaded from the db. when
+        `count` is given the ids are just the first of the list, and the
+        slices past them are loaded from `queryset`, ordered the same.
+    '''
+    def __init__(self, ids, queryset, count=None):
+        self.ids = ids
+        self.queryset = queryset
+        self._count = len(ids) if count is None else count
+
+    def _load(self, ids):
+        objects = self.queryset.in_bulk(ids)
+        return [objects[i] for i in ids if i in objects]
+
+    def _cached(self, stop):
+        return len(self.ids) >= self._count or \
+                (stop is not None and stop <= len(self.ids))
+
+    def count(self):
+        return self._count
+
+    def exists(self):
+        return bool(self._count)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        if self._cached(None):
+            return iter(self._load(self.ids))
+        return iter(self.queryset)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            if self._cached(k.stop):
+                return self._load(self.ids[k])
+            return list(self.queryset[k])
+        if self._cached(k + 1):
+            return self._load([self.ids[k]])[0]
+        return self.queryset[k]
@@ -0,0 +1,75 @@
+''' conditional GETs of the pages and feeds
+
+    the pages get an ETag made of the version stamps of `qa.caching`, the
+    viewer and the url, so a browser or a crawler revisiting an unchanged page
+    gets a 304 without it being rendered. the feeds are the same for everyone
+    and use the latest `updated_at` of their rows as their Last-Modified.
+'''
+import hashlib
+
+from django.contrib import messages
+from django.contrib.syndication.views import Feed
+from django.db.models import Max
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+
+from entities.models import Entity
+from qa.models import Question
+from qa.caching import entity_version, question_version
+
+def page_etag(request, *stamps):
+    ''' returns the ETag of the page the request's user gets when the data
+        it shows is stamped with `stamps`, None if it can't be reused '''
+    if len(messages.get_messages(request)):
+        # the messages are shown once, with a full render
+        return None
+    user = request.user
+    user_id = user.id if user.is_authenticated() else 0
+    parts = (user_id, get_language(), request.get_full_path()) + stamps
+    return hashlib.md5(u'|'.join(map(unicode, parts)).encode('utf8')).hexdigest()
+
+def entity_home_etag(request, entity_slug=None, entity_id=None, tags=None,
+                     **kwargs):
+    if not entity_id:
+        if not entity_slug:
+            return None
+        entity_ids = Entity.objects.filter(slug=entity_slug).\
+                        values_list('id', flat=True)[:1]
+        if not entity_ids:
+            return None
+        entity_id = entity_ids[0]
+    return page_etag(request, entity_version(entity_id))
+
+def question_detail_etag(request, slug, entity_id=None, entity_slug=None,
+                         **kwargs):
+    questions = Question.objects.filter(unislug=slug)
+    if entity_id:
+        questions = questions.filter(entity__id=entity_id)
+    else:
+        questions = questions.filter(entity__slug=entity_slug)
+    rows = questions.values_list('id', 'entity', 'updated_at', 'rating',
+                                 'flags_count')[:1]
+    if not rows:
+        return None
+    question_id, entity_id, updated_at, rating, flags_count = rows[0]
+    user = request.user
+    can_answer = user.is_authenticated() and user.profile.can_answer(entity_id)
+    return page_etag(request, question_version(question_id), updated_at,
+                     rating, flags_count, can_answer)
+
+
+class ConditionalFeed(Feed):
+    ''' a feed that answers a conditional GET with a 304 when nothing has
+        changed since `last_modified(request, *args, **kwargs)` '''
+
+    def last_modified(self, request, *args, **kwargs):
+        return None
+
+    def __call__(self, request, *args, **kwargs):
+        view = condition(last_modified_func=self.last_modified)(
+                    super(ConditionalFeed, self).__call__)
+        return view(request, *args, **kwargs)
+
+def latest_update(queryset):
+    ''' returns the latest `updated_at` of the rows, None if there are none '''
+    return queryset.aggregate(latest=Max('updated_at'))['latest']
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+''' a local full text search engine for haystack, on sqlite's FTS4
+
+    the documents are kept in a single sqlite file: an FTS4 table with a
+    column per string field of the search indexes and a table of the
+    documents' identifiers. the document field is indexed as normalized
+    hebrew words (see `index_terms`), every other string field as a single
+    token per value, so `place=Exact(slug)` is a lookup in the inverted index
+    that the words' postings are intersected with - a per place index, without
+    scanning the other places' documents.
+
+    sqlite's WAL journal lets any number of processes read the index while
+    one of them updates it, and the updates are per document, so the index
+    is kept up to date by `qa.indexing` like any other haystack backend.
+
+    the queries use AND, OR and parentheses, so sqlite must be compiled with
+    SQLITE_ENABLE_FTS3_PARENTHESIS, otherwise those would be searched as
+    words. `get_connection` checks it.
+
+    to use it, point the default haystack connection at `SQLiteFTSEngine`
+    with a 'PATH' for the index file and run `reindex_search --clear`. the
+    filters are limited to the document field and exact values of the other
+    string fields, and the results are ordered by relevance only. an auto
+    query's "phrases" and -excluded words are kept, see `build_auto_query`.
+'''
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import struct
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_unicode
+
+from haystack import connections
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery,\
+    log_query
+from haystack.constants import ID, DJANGO_CT, DJANGO_ID
+from haystack.exceptions import SearchBackendError
+from haystack.inputs import AutoQuery
+from haystack.models import SearchResult
+from haystack.utils import get_identifier
+
+''' hebrew aware normalization '''
+
+# the vowel points and cantillation marks, but not the maqaf and the other
+# punctuation of the block
+NIQQUD_RE = re.compile(u'[\u0591-\u05bd\u05bf\u05c1\u05c2\u05c4\u05c5\u05c7]')
+# geresh and gershayim, in hebrew or ascii, inside acronyms like צה"ל
+QUOTES_RE = re.compile(u'(?<=\\w)[\'"\u05f3\u05f4\u2019\u201d](?=\\w)', re.UNICODE)
+WORD_RE = re.compile(u'[^\\W_]+', re.UNICODE)
+# the quoted phrases of an auto query, once the acronyms' quotes are removed
+PHRASE_RE = re.compile(u'"([^"]*)"')
+HEBREW_WORD_RE = re.compile(u'^[\u05d0-\u05ea]+$')
+FINAL_LETTERS = {u'ך': u'כ', u'ם': u'מ', u'ן': u'נ', u'ף': u'פ', u'ץ': u'צ'}
+# the one letter prefixes - and, the, in, to, from, that, as
+PREFIXES = u'ובהלמשכ'
+MAX_PREFIXES = 3
+MIN_STEM = 3
+
+def normalize(text):
+    ''' returns the words of `text` in lower case, without niqqud and with
+        the final letters replaced by their regular forms '''
+    text = NIQQUD_RE.sub(u'', force_unicode(text).lower())
+    text = QUOTES_RE.sub(u'', text)
+    return [u''.join(FINAL_LETTERS.get(c, c) for c in word)
+            for word in WORD_RE.findall(text)]
+
+def variants(word):
+    ''' returns the word and, for a hebrew word, the word without each of the
+        prefixes it might start with, e.g. ובבית, בבית and בית '''
+    found = [word]
+    if HEBREW_WORD_RE.match(word):
+        for i in range(min(MAX_PREFIXES, len(word) - MIN_STEM)):
+            if word[i] not in PREFIXES:
+                break
+            found.append(word[i + 1:])
+    return found
+
+def index_terms(text):
+    ''' returns the terms a text is indexed under '''
+    return [term for word in normalize(text) for term in variants(word)]
+
+def field_token(value):
+    ''' returns the single token an exact value of a field is indexed as '''
+    return 'v%s' % hashlib.md5(force_unicode(value).encode('utf8')).hexdigest()[:16]
+
+def rank(matchinfo):
+    ''' the relevance of a row, from `matchinfo(fts, 'pcx')`: the hits of each
+        phrase in the row, relative to its hits in all the rows '''
+    info = struct.unpack('@%dI' % (len(matchinfo) / 4), str(matchinfo))
+    phrases, columns = info[:2]
+    score = 0.0
+    for i in range(phrases * columns):
+        row_hits, all_hits = info[2 + 3 * i], info[3 + 3 * i]
+        if row_hits:
+            score += float(row_hits) / all_hits
+    return score
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    # a document is in the index if one of these conditions matches its docid
+    IN_MATCH = 'd.docid IN (SELECT docid FROM fts WHERE fts MATCH ?)'
+
+    def __init__(self, connection_alias, **connection_options):
+        super(SQLiteFTSSearchBackend, self).__init__(connection_alias,
+                                                     **connection_options)
+        if not 'PATH' in connection_options:
+            raise ImproperlyConfigured("You must specify a 'PATH' in your settings for connection '%s'." % connection_alias)
+        self.path = connection_options['PATH']
+        self.local = threading.local()
+        self.log = logging.getLogger('haystack')
+        self.content_field_name, self.columns = None, None
+
+    def setup_schema(self):
+        ''' the FTS columns, the document field first, then the other string
+            fields of the search indexes '''
+        if self.columns is None:
+            fields = connections[self.connection_alias].get_unified_index().\
+                        all_searchfields()
+            columns = []
+            for field_name, field_class in fields.items():
+                if field_class.document:
+                    self.content_field_name = field_class.index_fieldname
+                elif field_class.field_type in ('string', 'edge_ngram', 'ngram'):
+                    columns.append(field_class.index_fieldname)
+            self.columns = [self.content_field_name] + sorted(set(columns))
+        return self.columns
+
+    def get_connection(self):
+        ''' returns the connection of this process and thread '''
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            options = [row[0] for row in
+                       connection.execute('PRAGMA compile_options')]
+            if 'ENABLE_FTS3_PARENTHESIS' not in options:
+                connection.close()
+                raise ImproperlyConfigured("The sqlite library must be compiled "
+                        "with SQLITE_ENABLE_FTS3_PARENTHESIS for '%s'." %
+                        self.connection_alias)
+            # readers don't wait for the writer and vice versa
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.create_function('rank', 1, rank)
+            self.create_tables(connection)
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return connection
+
+    def get_checked_connection(self):
+        ''' returns the connection, if the index has the current fields '''
+        connection = self.get_connection()
+        if not getattr(self.local, 'checked', False):
+            existing = [row[1] for row in
+                        connection.execute('PRAGMA table_info(fts)')]
+            if existing != self.columns:
+                raise SearchBackendError("The search fields changed, rebuild "
+                                         "the index with `reindex_search --clear`.")
+            self.local.checked = True
+        return connection
+
+    def create_tables(self, connection):
+        columns = self.setup_schema()
+        with connection:
+            connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS fts '
+                               'USING fts4(%s, tokenize=simple)' % ', '.join(columns))
+            connection.execute('CREATE TABLE IF NOT EXISTS documents ('
+                               'docid INTEGER PRIMARY KEY, '
+                               'identifier TEXT UNIQUE NOT NULL, '
+                               'django_ct TEXT NOT NULL, '
+                               'django_id TEXT NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS documents_django_ct '
+                               'ON documents (django_ct)')
+
+    def prepare_column(self, column, value):
+        if value is None:
+            return u''
+        if column == self.content_field_name:
+            return u' '.join(index_terms(value))
+        if not isinstance(value, (list, tuple, set)):
+            value = [value]
+        return u' '.join(field_token(v) for v in value)
+
+    def update(self, index, iterable, commit=True):
+        connection = self.get_checked_connection()
+        documents = [index.full_prepare(obj) for obj in iterable]
+        with connection:
+            for document in documents:
+                row = connection.execute('SELECT docid FROM documents '
+                        'WHERE identifier = ?', (document[ID], )).fetchone()
+                if row:
+                    docid = row[0]
+                    connection.execute('DELETE FROM fts WHERE docid = ?', (docid, ))
+                else:
+                    docid = connection.execute('INSERT INTO documents '
+                            '(identifier, django_ct, django_id) VALUES (?, ?, ?)',
+                            (document[ID], document[DJANGO_CT],
+                             force_unicode(document[DJANGO_ID]))).lastrowid
+                values = [self.prepare_column(c, document.get(c)) for c in self.columns]
+                connection.execute('INSERT INTO fts (docid, %s) VALUES (?, %s)' %
+                                   (', '.join(self.columns),
+                                    ', '.join('?' * len(self.columns))),
+                                   [docid] + values)
+
+    def remove(self, obj_or_string, commit=True):
+        connection = self.get_connection()
+        identifier = get_identifier(obj_or_string)
+        with connection:
+            connection.execute('DELETE FROM fts WHERE docid IN (SELECT docid '
+                               'FROM documents WHERE identifier = ?)', (identifier, ))
+            connection.execute('DELETE FROM documents WHERE identifier = ?',
+                               (identifier, ))
+
+    def clear(self, models=[], commit=True):
+        connection = self.get_connection()
+        with connection:
+            if models:
+                cts = ['%s.%s' % (m._meta.app_label, m._meta.module_name)
+                       for m in models]
+                where = 'django_ct IN (%s)' % ', '.join('?' * len(cts))
+                connection.execute('DELETE FROM fts WHERE docid IN (SELECT '
+                                   'docid FROM documents WHERE %s)' % where, cts)
+                connection.execute('DELETE FROM documents WHERE %s' % where, cts)
+            else:
+                connection.execute('DROP TABLE IF EXISTS fts')
+                connection.execute('DROP TABLE IF EXISTS documents')
+        if not models:
+            self.create_tables(connection)
+
+    @log_query
+    def search(self, query, start_offset=0, end_offset=None, models=None,
+               limit_to_registered_models=True, result_class=None, **kwargs):
+        ''' `query` is the (match, conditions, params) of
+            `SQLiteFTSSearchQuery.build_query` '''
+        match, conditions, params = query
+        if not models and limit_to_registered_models:
+            models = connections[self.connection_alias].get_unified_index().\
+                        get_indexed_models()
+        conditions, params = list(conditions), list(params)
+        if models:
+            cts = ['%s.%s' % (m._meta.app_label, m._meta.module_name)
+                   for m in models]
+            conditions.append('d.django_ct IN (%s)' % ', '.join('?' * len(cts)))
+            params += cts
+        if match:
+            tables = 'fts JOIN documents d ON d.docid = fts.docid'
+            conditions.insert(0, 'fts MATCH ?')
+            params.insert(0, match)
+            score = "rank(matchinfo(fts, 'pcx'))"
+        else:
+            tables = 'documents d'
+            score = '0'
+        where = ' AND '.join(conditions) or '1'
+
+        connection = self.get_checked_connection()
+        try:
+            hits = connection.execute('SELECT COUNT(*) FROM %s WHERE %s' %
+                                      (tables, where), params).fetchone()[0]
+            limit = -1 if end_offset is None else max(0, end_offset - start_offset)
+            rows = connection.execute('SELECT d.django_ct, d.django_id, %s AS score '
+                    'FROM %s WHERE %s ORDER BY score DESC, d.docid DESC '
+                    'LIMIT ? OFFSET ?' % (score, tables, where),
+                    params + [limit, start_offset]).fetchall()
+        except sqlite3.OperationalError, e:
+            if not self.silently_fail:
+                raise
+            self.log.error("Failed to query the index: %s", e)
+            return {'results': [], 'hits': 0}
+
+        result_class = result_class or SearchResult
+        results = []
+        for django_ct, django_id, score in rows:
+            app_label, model_name = django_ct.split('.')
+            results.append(result_class(app_label, model_name, django_id, score))
+        return {
+            'results': results,
+            'hits': hits,
+            'facets': {},
+            'spelling_suggestion': None,
+        }
+
+
+class SQLiteFTSSearchQuery(BaseSearchQuery):
+    def build_query_fragment(self, field, filter_type, value):
+        ''' returns the MATCH expression of a filter, None if nothing can
+            match it '''
+        # the input types keep the raw query
+        value = getattr(value, 'query_string', value)
+        self.backend.setup_schema()
+        if field == 'content':
+            field = self.backend.content_field_name
+        if field not in self.backend.columns:
+            raise SearchBackendError("Can't filter on '%s', it isn't a string "
+                                     "field." % field)
+        if field == self.backend.content_field_name:
+            words = normalize(value)
+            if not words:
+                return None
+            groups = []
+            for i, word in enumerate(words):
+                star = '*' if filter_type == 'startswith' and \
+                              i == len(words) - 1 else ''
+                groups.append(u'(%s)' % u' OR '.join(u'%s:%s%s' % (field, v, star)
+                                                   for v in variants(word)))
+            return u' AND '.join(groups)
+        if filter_type not in ('exact', 'contains', 'in'):
+            raise SearchBackendError("The '%s' filter isn't supported." % filter_type)
+        values = value if filter_type == 'in' else [value]
+        if not values:
+            return None
+        return u'(%s)' % u' OR '.join(u'%s:%s' % (field, field_token(v))
+                                     for v in values)
+
+    def build_auto_query(self, field, value):
+        ''' returns the MATCH expression of an auto query's words and
+            "phrases", and the conditions and params that exclude its
+            -words. a phrase is matched as the sequence of its index terms,
+            which is what the index has wherever its words follow each other.
+            fts4 can't limit a phrase to a column, but the other columns only
+            have `field_token`s '''
+        self.backend.setup_schema()
+        if field == 'content':
+            field = self.backend.content_field_name
+        query = QUOTES_RE.sub(u'', force_unicode(value.query_string))
+        required, excluded = [], []
+        for phrase in PHRASE_RE.findall(query):
+            terms = index_terms(phrase)
+            if terms:
+                required.append(u'"%s"' % u' '.join(terms))
+        for token in PHRASE_RE.sub(u' ', query).split():
+            if token.startswith(u'-') and len(token) > 1:
+                match = self.build_query_fragment(field, 'contains', token[1:])
+                if match:
+                    excluded.append(match)
+            else:
+                match = self.build_query_fragment(field, 'contains', token)
+                if match:
+                    required.append(match)
+        conditions = [u'NOT %s' % self.backend.IN_MATCH] * len(excluded)
+        if not required and not excluded:
+            # like a query without words
+            conditions.append('0')
+        return u' AND '.join(required) or None, conditions, excluded
+
+    def build_query(self):
+        ''' returns the MATCH expression, or None, and the other sql
+            conditions, with their params, that a document must meet '''
+        return self.required(self.query_filter)
+
+    def leaf(self, node, child):
+        ''' returns the MATCH expression of a filter, and the sql conditions,
+            with their params, the document must meet as well '''
+        expression, value = child
+        field, filter_type = node.split_expression(expression)
+        if isinstance(value, AutoQuery):
+            return self.build_auto_query(field, value)
+        match = self.build_query_fragment(field, filter_type, value)
+        return match, ['0'] if match is None else [], []
+
+    def required(self, node):
+        ''' the AND of the node's filters goes into a single MATCH expression,
+            anything else becomes a condition '''
+        if node.connector != 'AND' or node.negated:
+            sql, params = self.condition(node)
+            return None, [sql], params
+        matches, conditions, params = [], [], []
+        for child in node.children:
+            if hasattr(child, 'children'):
+                match, child_conditions, child_params = self.required(child)
+            else:
+                match, child_conditions, child_params = self.leaf(node, child)
+            if match:
+                matches.append(match)
+            conditions += child_conditions
+            params += child_params
+        return u' AND '.join(matches) or None, conditions, params
+
+    def condition(self, node):
+        ''' returns the sql condition of the node and its params '''
+        parts, params = [], []
+        for child in node.children:
+            if hasattr(child, 'children'):
+                match, conditions, child_params = self.required(child)
+            else:
+                match, conditions, child_params = self.leaf(node, child)
+            if match:
+                conditions = [self.backend.IN_MATCH] + conditions
+                child_params = [match] + child_params
+            parts.append(u'(%s)' % u' AND '.join(conditions or ['1']))
+            params += child_params
+        sql = u'(%s)' % (u' %s ' % node.connector).join(parts or ['1'])
+        if node.negated:
+            sql = u'NOT %s' % sql
+        return sql, params
+
+
+class SQLiteFTSEngine(BaseEngine):
+    backend = SQLiteFTSSearchBackend
+    query = SQLiteFTSSearchQuery
@@ -0,0 +1,163 @@
+''' batched search indexing
+
+    instead of a celery task per save, `BatchedSignalProcessor` queues the
+    changed questions and answers in `IndexQueue`, where the changes of an
+    object coalesce, and schedules a single `qa.tasks.flush_search_index` to
+    run `SEARCH_INDEX_WINDOW` seconds later. the flush indexes the queued
+    objects in bulk and removes the ones that were deleted, soft deleted
+    objects included, from the index. it then invalidates the cached searches
+    of the places that changed, or of all of them when objects were removed.
+    a model's queued objects leave the queue once they're flushed, and an
+    object that fails to index on its own is logged and dropped.
+
+    the window is kept by a flag in the cache, so the batching needs a cache
+    shared by the processes, like memcached. with a cache that doesn't keep
+    anything, e.g. the dummy cache, every change is flushed right away.
+
+    haystack creates the signal processor while it's imported, so the models
+    are only imported when they're needed.
+'''
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.db.models import signals, get_model
+from haystack.signals import BaseSignalProcessor
+from haystack import connections
+
+from qa.caching import bump_search_version
+
+QUEUED_MODELS = ('qa.question', 'qa.answer')
+FLUSH_SCHEDULED_KEY = 'search_index_flush_scheduled'
+
+logger = logging.getLogger(__name__)
+
+def model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.module_name)
+
+def enqueue(model, ids):
+    ''' queues the objects of `model` with `ids` for the next flush '''
+    from qa.models import IndexQueue
+    label = model_label(model)
+    ids = set(ids)
+    if not ids:
+        return
+    queued = IndexQueue.objects.filter(model=label, object_id__in=ids)
+    missing = ids - set(queued.values_list('object_id', flat=True))
+    sid = transaction.savepoint()
+    try:
+        IndexQueue.objects.bulk_create([IndexQueue(model=label, object_id=i)
+                                        for i in missing])
+        transaction.savepoint_commit(sid)
+    except IntegrityError:
+        # queued at the same time by another process
+        transaction.savepoint_rollback(sid)
+        for object_id in missing:
+            IndexQueue.objects.get_or_create(model=label, object_id=object_id)
+
+def schedule_flush():
+    ''' the first change in a window schedules the flush of all of them '''
+    from qa.tasks import flush_search_index
+    window = settings.SEARCH_INDEX_WINDOW
+    if not cache.add(FLUSH_SCHEDULED_KEY, True, window):
+        return
+    if cache.get(FLUSH_SCHEDULED_KEY) is None:
+        # the cache can't keep the flag, so there's no window to batch in
+        flush_search_index.delay()
+    else:
+        flush_search_index.apply_async(countdown=window)
+
+def update(backend, index, objects):
+    ''' indexes `objects`, one at a time if the batch fails. returns the
+        ones that were indexed, the rest are logged and dropped '''
+    try:
+        backend.update(index, objects)
+        return objects
+    except Exception:
+        logger.warning("Failed to index a batch of %d, indexing them one at "
+                       "a time", len(objects), exc_info=True)
+    indexed = []
+    for obj in objects:
+        try:
+            backend.update(index, [obj])
+            indexed.append(obj)
+        except Exception:
+            logger.exception("Failed to index %s.%s", model_label(type(obj)),
+                             obj.pk)
+    return indexed
+
+def flush(using='default'):
+    ''' indexes the queued objects that should be searchable and removes the
+        rest from the index. returns the number of objects flushed '''
+    from qa.models import IndexQueue
+    # the changes from now on are for the next flush
+    cache.delete(FLUSH_SCHEDULED_KEY)
+    queued = list(IndexQueue.objects.values_list('id', 'model', 'object_id'))
+    if not queued:
+        return 0
+    by_model = defaultdict(dict)
+    for id, label, object_id in queued:
+        by_model[label][object_id] = id
+
+    backend = connections[using].get_backend()
+    unified_index = connections[using].get_unified_index()
+    places, removed = set(), False
+    try:
+        for label, queue_ids in by_model.items():
+            model = get_model(*label.split('.'))
+            index = unified_index.get_index(model)
+            ids = set(queue_ids)
+            live = list(index.index_queryset(using=using).filter(pk__in=ids))
+            if live:
+                for obj in update(backend, index, live):
+                    places.add(index.fields['place'].prepare(obj) or u'')
+            for object_id in ids - set(obj.pk for obj in live):
+                backend.remove('%s.%s' % (label, object_id))
+                removed = True
+            # the labels that failed stay queued for the next flush
+            IndexQueue.objects.filter(id__in=queue_ids.values()).delete()
+    except Exception:
+        schedule_flush()
+        raise
+    finally:
+        if removed:
+            bump_search_version()
+        else:
+            for place in places:
+                bump_search_version(place)
+    return len(queued)
+
+
+class BatchedSignalProcessor(BaseSignalProcessor):
+    ''' queues the changed objects for a batched flush '''
+
+    def setup(self):
+        signals.post_save.connect(self.handle_save)
+        signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        signals.post_save.disconnect(self.handle_save)
+        signals.post_delete.disconnect(self.handle_delete)
+
+    def handle_save(self, sender, instance, created, **kwargs):
+        label = model_label(sender)
+        if label not in QUEUED_MODELS:
+            return
+        enqueue(sender, [instance.pk])
+        if label == 'qa.question' and not created:
+            # the answers are searchable in the question's place, while it is
+            from qa.signals import answers_state
+            state = answers_state(instance)
+            if state is None or \
+                    state != getattr(instance, '_indexed_answers_state', None):
+                answers = instance.answers
+                enqueue(answers.model, answers.values_list('id', flat=True))
+            instance._indexed_answers_state = state
+        schedule_flush()
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if model_label(sender) in QUEUED_MODELS:
+            enqueue(sender, [instance.pk])
+            schedule_flush()
@@ -0,0 +1,47 @@
+''' the candidates' leaderboard
+
+    the number of answers of every candidate, kept in his membership of the
+    entity, and of every candidate list, the sum of its members' counts.
+    the receivers in `qa.signals` keep them up to date as answers are posted
+    and deleted, so the candidates panel is a single ordered lookup.
+'''
+from django.db.models import F, Sum
+
+from qa.models import Answer
+from user.models import Membership
+from polyorg.models import CandidateList
+
+def counted_answers(user_id, entity_id):
+    ''' counts the user's answers in the entity from scratch '''
+    return Answer.objects.filter(author=user_id, question__entity=entity_id,
+                                 is_deleted=False,
+                                 question__is_deleted=False).count()
+
+def change(user_id, entity_id, change):
+    ''' atomically adds `change` to the user's counts in the entity '''
+    memberships = Membership.objects.filter(user=user_id, entity=entity_id)
+    if memberships.update(answers_count=F('answers_count') + change):
+        list_ids = list(memberships.exclude(member_of=None).\
+                            values_list('member_of', flat=True))
+        CandidateList.objects.filter(id__in=list_ids).\
+                update(answers_count=F('answers_count') + change)
+
+def recount(user_id, entity_id):
+    ''' counts the user's answers in the entity and his lists' from scratch '''
+    memberships = Membership.objects.filter(user=user_id, entity=entity_id)
+    memberships.update(answers_count=counted_answers(user_id, entity_id))
+    for list_id in set(memberships.exclude(member_of=None).\
+                        values_list('member_of', flat=True)):
+        recount_list(list_id)
+
+def recount_list(list_id):
+    ''' sums the answers of the list's members '''
+    total = Membership.objects.filter(member_of=list_id).\
+                aggregate(total=Sum('answers_count'))['total']
+    CandidateList.objects.filter(id=list_id).update(answers_count=total or 0)
+
+def recount_entity(entity_id):
+    ''' counts the whole leaderboard of the entity from scratch '''
+    for user_id in Membership.objects.filter(entity=entity_id, can_answer=True).\
+                        values_list('user', flat=True):
+        recount(user_id, entity_id)
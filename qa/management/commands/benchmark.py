@@ -0,0 +1,359 @@
+import json
+import random
+import time
+from functools import partial
+from datetime import datetime
+from optparse import make_option
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, reset_queries
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from haystack.inputs import Exact
+from haystack.query import SearchQuerySet
+
+from actstream.models import Follow
+from flatblocks.models import FlatBlock
+from taggit.models import Tag
+
+from entities.models import Domain, Division, Entity
+from polyorg.models import CandidateList
+from qa.models import Question, Answer, QuestionUpvote, TaggedQuestion
+from user.bulk import chunked, bulk_create_users
+from user.models import User, Membership
+
+PASSWORD = 'benchmark'
+# the dataset of --scale 1, per entity where it says so
+SIZES = {
+    'entities': 1000,
+    'voters': 100,          # per entity
+    'lists': 3,             # per entity
+    'candidates': 4,        # per list
+    'questions': 200,       # per entity
+    'answers': 0.5,         # per question
+    'upvotes': 2,           # per question
+    'follows': 1,           # per question
+    'tags': 200,
+}
+SCENARIOS = ('entity_home', 'entity_home_cursor', 'question_detail',
+             'upvote_downvote', 'post_answer', 'entity_feed', 'answers_feed',
+             'sitemap', 'send_emails', 'search')
+
+
+class Command(BaseCommand):
+    help = 'generate a synthetic dataset and measure the hot paths against it'
+    option_list = BaseCommand.option_list + (
+        make_option('--test-db', action='store_true', dest='test_db', default=False,
+            help='run against a throwaway test database, implies --generate'),
+        make_option('--generate', action='store_true', dest='generate', default=False,
+            help='generate the dataset before measuring'),
+        make_option('--scale', type='float', dest='scale', default=1.0,
+            help='scale the number of entities of the dataset, 1 is %d' % \
+                    SIZES['entities']),
+        make_option('--requests', type='int', dest='requests', default=100,
+            help='number of requests per scenario'),
+        make_option('--only', dest='only', default=None,
+            help='comma separated scenarios to run, out of: %s' % ', '.join(SCENARIOS)),
+        make_option('--search-using', dest='search_using', default='default',
+            help='comma separated haystack connections the search scenario '
+                 'compares, e.g. default,fts'),
+        make_option('--reindex', action='store_true', dest='reindex', default=False,
+            help='rebuild the indexes of --search-using from the database first'),
+        make_option('--seed', type='int', dest='seed', default=42,
+            help='random seed of the dataset and the requests'),
+        make_option('--output', dest='output', default=None,
+            help='write the json report to this file instead of stdout'),
+    )
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options['verbosity'])
+        self.random = random.Random(options['seed'])
+        scenarios = options['only'].split(',') if options['only'] \
+                        else list(SCENARIOS)
+        for scenario in scenarios:
+            if scenario.split(':')[0] not in SCENARIOS:
+                raise CommandError('unknown scenario %s' % scenario)
+        if 'search' in scenarios:
+            # a search scenario per connection, e.g. search:fts
+            i = scenarios.index('search')
+            scenarios[i:i + 1] = ['search:%s' % alias
+                                  for alias in options['search_using'].split(',')]
+
+        old_name = None
+        if options['test_db']:
+            old_name = connection.creation.create_test_db(verbosity=0,
+                                                          autoclobber=True)
+            options['generate'] = True
+        try:
+            report = {
+                'started_at': datetime.utcnow().isoformat(),
+                'database': connection.vendor,
+                'seed': options['seed'],
+                'requests': options['requests'],
+            }
+            if options['generate']:
+                start = time.time()
+                self.generate(options['scale'])
+                report['generate_seconds'] = round(time.time() - start, 1)
+            report['dataset'] = self.dataset()
+            if not report['dataset']['questions']:
+                raise CommandError('no questions to measure, use --generate')
+            if options['reindex']:
+                for scenario in scenarios:
+                    if scenario.startswith('search:'):
+                        self.log('reindexing %s' % scenario)
+                        call_command('reindex_search', clear=True, verbosity=0,
+                                     using=scenario.split(':')[1])
+            self.load_samples()
+            with override_settings(CELERY_ALWAYS_EAGER=True, DEBUG=False,
+                    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+                report['scenarios'] = dict((scenario,
+                        self.measure(scenario, options['requests']))
+                            for scenario in scenarios)
+        finally:
+            if old_name:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output + '\n')
+
+    def log(self, message):
+        if self.verbosity > 0:
+            self.stderr.write('> %s\n' % message)
+
+    ''' the synthetic dataset '''
+
+    def generate(self, scale):
+        n_entities = max(1, int(SIZES['entities'] * scale))
+        password = make_password(PASSWORD)
+        domain, created = Domain.objects.get_or_create(name='benchmark')
+        division, created = Division.objects.get_or_create(name='benchmark',
+                                                           domain=domain, index=3)
+        offset = Entity.objects.filter(division=division).count()
+        Entity.objects.bulk_create([Entity(name='benchmark %d' % i,
+                slug='benchmark-%d' % i, code='b%d' % i, division=division)
+            for i in range(offset, offset + n_entities)], 500)
+        entity_ids = list(Entity.objects.filter(division=division).\
+                            order_by('id').values_list('id', flat=True)[offset:])
+        self.log('%d entities' % len(entity_ids))
+
+        CandidateList.objects.bulk_create([CandidateList(name='list %d' % i,
+                ballot=str(i), entity_id=entity_id)
+            for entity_id in entity_ids for i in range(SIZES['lists'])], 500)
+        lists = {}
+        for list_id, entity_id in CandidateList.objects.\
+                filter(entity__in=entity_ids).values_list('id', 'entity'):
+            lists.setdefault(entity_id, []).append(list_id)
+
+        voters, candidates = {}, {}
+        for entity_id in entity_ids:
+            users = [User(username='b%d_v%d' % (entity_id, i), password=password,
+                          email='b%d_v%d@example.com' % (entity_id, i))
+                        for i in range(SIZES['voters'])]
+            voters[entity_id] = bulk_create_users(users).values()
+            members = [Membership(user_id=user_id, entity_id=entity_id)
+                        for user_id in voters[entity_id]]
+            candidates[entity_id] = []
+            for list_id in lists[entity_id]:
+                users = [User(username='b%d_l%d_c%d' % (entity_id, list_id, i),
+                              password=password)
+                            for i in range(SIZES['candidates'])]
+                for user_id in bulk_create_users(users, verification=u'V').values():
+                    candidates[entity_id].append(user_id)
+                    members.append(Membership(user_id=user_id, entity_id=entity_id,
+                            can_answer=True, member_of_id=list_id))
+            Membership.objects.bulk_create(members)
+        self.log('%d users' % sum(len(v) + len(candidates[e])
+                                   for e, v in voters.items()))
+
+        questions_per_entity = SIZES['questions']
+        for entity_ids_chunk in chunked(entity_ids, 50):
+            Question.objects.bulk_create([Question(entity_id=entity_id,
+                    author_id=self.random.choice(voters[entity_id]),
+                    subject='question %d of %d' % (i, entity_id),
+                    unislug='question-%d-of-%d' % (i, entity_id),
+                    content='lorem ipsum ' * self.random.randint(1, 50),
+                    rating=1 + self.random.randint(0, SIZES['upvotes'] * 2))
+                for entity_id in entity_ids_chunk
+                for i in range(questions_per_entity)], 1000)
+        questions = list(Question.objects.filter(entity__in=entity_ids).\
+                            values_list('id', 'entity', 'author'))
+        self.log('%d questions' % len(questions))
+
+        tags = [Tag.objects.get_or_create(name='benchmark %d' % i,
+                    defaults={'slug': 'benchmark-%d' % i})[0].id
+                    for i in range(SIZES['tags'])]
+        question_ct = ContentType.objects.get_for_model(Question)
+        for chunk in chunked(questions, 5000):
+            answers, upvotes, follows, tagged = [], set(), set(), []
+            for question_id, entity_id, author_id in chunk:
+                if self.random.random() < SIZES['answers']:
+                    answers.append(Answer(question_id=question_id,
+                        author_id=self.random.choice(candidates[entity_id]),
+                        content='answer to %d' % question_id))
+                for i in range(self.random.randint(0, SIZES['upvotes'] * 2)):
+                    upvotes.add((question_id, self.random.choice(voters[entity_id])))
+                for i in range(self.random.randint(0, SIZES['follows'] * 2)):
+                    follows.add((question_id, self.random.choice(voters[entity_id])))
+                follows.add((question_id, author_id))
+                for tag_id in set(self.random.sample(tags, self.random.randint(0, 3))):
+                    tagged.append(TaggedQuestion(content_object_id=question_id,
+                                                 tag_id=tag_id))
+            Answer.objects.bulk_create(answers, 1000)
+            QuestionUpvote.objects.bulk_create([QuestionUpvote(question_id=q,
+                    user_id=u) for q, u in upvotes], 1000)
+            Follow.objects.bulk_create([Follow(content_type=question_ct,
+                    object_id=q, user_id=u) for q, u in follows], 1000)
+            TaggedQuestion.objects.bulk_create(tagged, 1000)
+
+        # the bulk inserts skipped the signals of the denormalized counters
+        call_command('rebuild_counters', *entity_ids, verbosity=0)
+        FlatBlock.objects.get_or_create(slug="candidate_update_email.subject",
+                                        defaults={'content': 'updates'})
+
+    def dataset(self):
+        return {
+            'entities': Entity.objects.count(),
+            'users': User.objects.count(),
+            'memberships': Membership.objects.count(),
+            'questions': Question.objects.count(),
+            'answers': Answer.objects.count(),
+            'upvotes': QuestionUpvote.objects.count(),
+            'follows': Follow.objects.count(),
+        }
+
+    def load_samples(self):
+        ''' picks the questions, voters and candidates the requests use '''
+        self.questions = list(Question.objects.filter(is_deleted=False).\
+                order_by('?').values_list('id', 'entity', 'unislug', 'author',
+                                          'subject')[:1000])
+        entity_ids = set(q[1] for q in self.questions)
+        self.voters, self.candidates = {}, {}
+        for user_id, username, entity_id, can_answer in Membership.objects.\
+                filter(entity__in=entity_ids, user__username__startswith='b').\
+                values_list('user', 'user__username', 'entity', 'can_answer'):
+            members = self.candidates if can_answer else self.voters
+            members.setdefault(entity_id, []).append((user_id, username))
+        self.questions = [q for q in self.questions
+                            if q[1] in self.voters and q[1] in self.candidates]
+        if not self.questions:
+            raise CommandError('no generated users to make the requests with')
+        self.clients = {}
+        self.slugs = dict(Entity.objects.filter(id__in=entity_ids).\
+                            values_list('id', 'slug'))
+
+    def client_for(self, username):
+        ''' returns a client logged in as `username` '''
+        if username not in self.clients:
+            client = Client()
+            client.login(username=username, password=PASSWORD)
+            self.clients[username] = client
+        return self.clients[username]
+
+    ''' the scenarios, each prepares a request and returns it as a callable '''
+
+    def prepare_entity_home(self, question):
+        return lambda: Client().get(reverse('entity_home', args=(question[1], )))
+
+    def prepare_entity_home_cursor(self, question):
+        return lambda: Client().get(reverse('entity_home', args=(question[1], )),
+                                    {'cursor': '', 'order': 'date'})
+
+    def prepare_question_detail(self, question):
+        return lambda: Client().get(reverse('question_detail',
+                kwargs={'entity_id': question[1], 'slug': question[2]}))
+
+    def prepare_upvote_downvote(self, question):
+        # the author can't vote for the question
+        user_id, username = self.random.choice([v for v in self.voters[question[1]]
+                                                if v[0] != question[3]])
+        client = self.client_for(username)
+        def request():
+            client.post(reverse('upvote_question', args=(question[0], )))
+            self.count_queries()
+            return client.post(reverse('downvote_question', args=(question[0], )))
+        return request
+
+    def prepare_post_answer(self, question):
+        user_id, username = self.random.choice(self.candidates[question[1]])
+        client = self.client_for(username)
+        return lambda: client.post(reverse('post_answer', args=(question[0], )),
+                                   {'content': 'a benchmark answer'})
+
+    def prepare_entity_feed(self, question):
+        return lambda: Client().get(reverse('atom_entity_questions',
+                                            args=(question[1], )))
+
+    def prepare_answers_feed(self, question):
+        return lambda: Client().get(reverse('atom_question_answers',
+                                            args=(question[0], )))
+
+    def prepare_sitemap(self, question):
+        return lambda: Client().get('/sitemap.xml')
+
+    def prepare_send_emails(self, question):
+        return lambda: call_command('send_emails', verbosity=0)
+
+    def prepare_search(self, question, using):
+        ''' a place search for a word of the question's subject, like
+            `oshot.views.place_search` makes, on the `using` connection '''
+        word = self.random.choice(question[4].split())
+        place = self.slugs[question[1]]
+        def request():
+            searchqs = SearchQuerySet().using(using).\
+                        filter(place=Exact(place)).auto_query(word)
+            list(searchqs[:20])
+            return searchqs.count()
+        return request
+
+    def count_queries(self):
+        ''' adds the queries of a request to the measured ones, for the
+            scenarios that make more than one request '''
+        self.earlier_queries += len(connection.queries)
+
+    def measure(self, scenario, n):
+        if scenario == 'send_emails':
+            n = 1 # a run covers all the users
+        self.log('measuring %s' % scenario)
+        name, _, using = scenario.partition(':')
+        prepare = getattr(self, 'prepare_%s' % name)
+        if using:
+            prepare = partial(prepare, using=using)
+        latencies, queries, statuses = [], [], {}
+        debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            for i in range(n):
+                request = prepare(self.random.choice(self.questions))
+                reset_queries()
+                self.earlier_queries = 0
+                start = time.time()
+                response = request()
+                latencies.append((time.time() - start) * 1000)
+                # the client resets the queries log on every request, so
+                # these are the last request's and the counted earlier ones
+                queries.append(self.earlier_queries + len(connection.queries))
+                status = str(getattr(response, 'status_code', 'done'))
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            connection.use_debug_cursor = debug_cursor
+        latencies.sort()
+        return {
+            'requests': n,
+            'statuses': statuses,
+            'mean_ms': round(sum(latencies) / n, 2),
+            'p50_ms': round(latencies[n / 2], 2),
+            'p95_ms': round(latencies[min(n - 1, int(n * 0.95))], 2),
+            'max_ms': round(latencies[-1], 2),
+            'requests_per_second': round(n * 1000 / sum(latencies), 2),
+            'mean_queries': round(sum(queries) / float(n), 2),
+        }
@@ -0,0 +1,87 @@
+import re
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+
+from actstream.models import Follow
+from entities.models import Entity
+from links.models import Link
+from qa.models import Question, Answer, QuestionUpvote
+from user.models import Membership
+
+# the plans' lines that mean a table is read from start to end
+SEQ_SCAN_RE = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'SCAN (?:TABLE )?(?!TABLE\b)(\w+)\b(?! USING (?:COVERING )?INDEX)'),
+}
+EXPLAIN = {
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+def canonical_queries():
+    ''' the hot query shapes of `qa.views` and `user.models`, as
+        (name, queryset) '''
+    entity_id = Entity.objects.values_list('id', flat=True)[:1]
+    entity_id = entity_id[0] if entity_id else 1
+    user_id = User.objects.values_list('id', flat=True)[:1]
+    user_id = user_id[0] if user_id else 1
+    question_ct = ContentType.objects.get_for_model(Question)
+    entity_ct = ContentType.objects.get_for_model(Entity)
+    questions = Question.objects.filter(entity=entity_id, is_deleted=False)
+    return (
+        ('questions by rating', questions.order_by('-rating', '-id')[:20]),
+        ('questions by date', questions.order_by('-created_at', '-id')[:20]),
+        ('question answers', Answer.objects.filter(question=1, is_deleted=False)),
+        ('author answers', Answer.objects.filter(author=user_id)),
+        ('user memberships', Membership.objects.filter(user=user_id)),
+        ('user membership in entity', Membership.objects.filter(user=user_id,
+                                                                entity=entity_id)),
+        ('question upvote', QuestionUpvote.objects.filter(question=1, user=user_id)),
+        ('question followers', Follow.objects.filter(content_type=question_ct,
+                                                     object_id=1)),
+        ('object links', Link.objects.filter(content_type=entity_ct,
+                                             object_pk='1', active=True)),
+    )
+
+
+class Command(BaseCommand):
+    help = 'explain the hot queries and flag those that scan whole tables'
+    option_list = BaseCommand.option_list + (
+        make_option('--allow-seqscan', action='store_true', dest='allow_seqscan',
+            default=False,
+            help="let postgres' planner pick sequential scans of small tables"),
+    )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in EXPLAIN:
+            raise CommandError("can't explain queries on %s" % vendor)
+        cursor = connection.cursor()
+        if vendor == 'postgresql' and not options['allow_seqscan']:
+            # a fresh database is small enough to always be scanned, so make
+            # the planner use an index whenever there is one
+            cursor.execute('SET enable_seqscan = off')
+
+        flagged = []
+        for name, queryset in canonical_queries():
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(EXPLAIN[vendor] + sql, params)
+            plan = '\n'.join(' '.join(unicode(c) for c in row)
+                             for row in cursor.fetchall())
+            scanned = SEQ_SCAN_RE[vendor].findall(plan)
+            if scanned:
+                flagged.append(name)
+                self.stdout.write("!!! %s scans %s\n" % (name, ', '.join(scanned)))
+                if int(options['verbosity']) > 1:
+                    self.stdout.write("%s\n" % plan)
+            else:
+                self.stdout.write("> %s uses an index\n" % name)
+
+        if vendor == 'postgresql' and not options['allow_seqscan']:
+            cursor.execute('SET enable_seqscan = on')
+        if flagged:
+            raise CommandError("%d queries scan whole tables" % len(flagged))
@@ -0,0 +1,22 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from qa.models import LocalityStats
+
+
+class Command(BaseCommand):
+    args = '[stats_file]'
+    help = "load the CBS locality stats, a json of {code: {field: value}}, "\
+           "replacing the current ones"
+
+    def handle(self, *args, **options):
+        path = args[0] if args else settings.CBS_STATS_FILE
+        try:
+            with open(path) as f:
+                rows = json.load(f)
+        except (IOError, ValueError), e:
+            raise CommandError("can't read %s: %s" % (path, e))
+        count = LocalityStats.load(rows)
+        self.stdout.write("> loaded the stats of %d localities\n" % count)
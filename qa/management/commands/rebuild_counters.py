@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from entities.models import Entity
+from qa.models import EntityStats, EntityTag
+from qa import leaderboard
+
+
+class Command(BaseCommand):
+    args = '[entity_id1 entity_id2 ...]'
+    help = 'count the denormalized entity counters, tag clouds and leaderboards from scratch'
+
+    def handle(self, *args, **options):
+        entities = Entity.objects.all()
+        if args:
+            entities = entities.filter(id__in=args)
+        for entity_id in entities.values_list('id', flat=True).iterator():
+            EntityStats.recount(entity_id)
+            EntityTag.recount(entity_id)
+            leaderboard.recount_entity(entity_id)
+        self.stdout.write("> recounted %d entities\n" % entities.count())
@@ -0,0 +1,75 @@
+from multiprocessing import Process
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection as db_connection
+
+from haystack import connections
+
+from qa.models import Question, Answer
+from qa import indexing
+from qa.caching import bump_search_version
+
+class Command(BaseCommand):
+    help = 'index all the live questions and answers, in chunks and in parallel'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=500,
+            help='number of objects to load and index at once'),
+        make_option('--workers', type='int', dest='workers', default=1,
+            help='split the chunks between this number of worker processes'),
+        make_option('--clear', action='store_true', dest='clear', default=False,
+            help='empty the index first, dropping the deleted objects'),
+        make_option('--using', dest='using', default='default',
+            help='the haystack connection to index'),
+    )
+
+    def handle(self, *args, **options):
+        self.using = options['using']
+        self.batch_size = options['batch_size']
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be positive')
+        if self.using == 'default':
+            # the queued removals aren't in the index querysets, and the
+            # queue is only flushed to the default connection
+            indexing.flush(using='default')
+        if options['clear']:
+            connections[self.using].get_backend().clear()
+            self.stdout.write("> cleared the index\n")
+
+        chunks = []
+        unified_index = connections[self.using].get_unified_index()
+        for model in (Question, Answer):
+            index = unified_index.get_index(model)
+            ids = list(index.index_queryset(using=self.using).\
+                            order_by('pk').values_list('pk', flat=True))
+            chunks += [(model, ids[i:i + self.batch_size])
+                       for i in range(0, len(ids), self.batch_size)]
+            self.stdout.write("> %d %s to index\n" %
+                              (len(ids), model._meta.verbose_name_plural))
+
+        if workers == 1:
+            self.index_chunks(chunks)
+        else:
+            # the workers must not share the parent's db connection
+            db_connection.close()
+            processes = [Process(target=self.index_chunks,
+                                 args=(chunks[i::workers], ))
+                         for i in range(workers)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            if any(process.exitcode for process in processes):
+                raise CommandError("some of the workers failed")
+        bump_search_version()
+
+    def index_chunks(self, chunks):
+        backend = connections[self.using].get_backend()
+        unified_index = connections[self.using].get_unified_index()
+        for model, ids in chunks:
+            index = unified_index.get_index(model)
+            backend.update(index, index.index_queryset(using=self.using).\
+                                    filter(pk__in=ids))
+            self.stdout.write("> indexed %d %s\n" %
+                              (len(ids), model._meta.verbose_name_plural))
@@ -1,109 +1,206 @@
 # -*- coding: utf-8 -*-
-import urlparse
-from datetime import datetime,timedelta
-import re
+from datetime import timedelta
+from multiprocessing import Process
+from optparse import make_option
+import itertools
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.core.mail import EmailMultiAlternatives
-from django.utils.html import strip_tags
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection as db_connection
+from django.db.models import Q
 from django.template.loader import render_to_string
 from django.utils import translation, timezone
-from django.utils.translation import ugettext as _
-from django.core.urlresolvers import reverse
 
 from flatblocks.models import FlatBlock
 
-from user.models import Profile, NEVER_SENT
-from qa.models import Question, QuestionUpvote,Answer
+from user.models import Profile, Membership
+from entities.models import Entity
+from qa.models import Question, Answer
 from actstream.models import Follow
 from oshot.utils import get_root_url
 
 class Command(BaseCommand):
-    args = '[username1 username2 ...]'
+    args = '[email1 email2 ...]'
     help = 'send email updates to users that want it'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+            help='number of users to process, and send to over one connection, at once'),
+        make_option('--shards', type='int', dest='shards', default=1,
+            help='split the users between this number of worker processes'),
+        make_option('--shard', type='int', dest='shard', default=None,
+            help='only send to this shard of the users, numbered from 0'),
+    )
 
     diffs = dict(D=timedelta(0, 23*3600),
                  W=timedelta(0, (23+6*24)*3600))
 
-    fresh_content_re = re.compile("(new-content)|(updated-content)")
-    cache = {}
-
     def handle (self, *args, **options):
         translation.activate(settings.LANGUAGE_CODE)
         self.start = timezone.now()
         self.q_ct = ContentType.objects.get_for_model(Question)
-        self.stdout.write("> sending updates at %s" % self.start)
-        if len(args):
-            for user in User.objects.filter(email__in=args):
-                self.update_user(user)
+        self.subject = FlatBlock.objects.get(slug="candidate_update_email.subject").content
+        self.root_url = get_root_url()
+        self.batch_size = options['batch_size']
+        self.emails = args
+        self.stdout.write("> sending updates at %s\n" % self.start)
+
+        shards = options['shards']
+        if shards < 1:
+            raise CommandError('--shards must be positive')
+        if options['shard'] is not None:
+            self.update_shard(options['shard'], shards)
+        elif shards == 1:
+            self.update_shard(0, 1)
         else:
-            for user in User.objects.all():
-                self.update_user(user)
+            # the workers must not share the parent's db connection
+            db_connection.close()
+            workers = [Process(target=self.update_shard, args=(i, shards))
+                            for i in range(shards)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
 
-    def update_user(self, user):
-        if not user.is_active or not user.email:
-            ''' inactive users get nothing! '''
-            return
+    def get_profiles(self, shard, shards):
+        ''' returns an iterator of the profiles due for an update '''
+        due = Q()
+        for freq, diff in self.diffs.items():
+            due |= Q(email_notification=freq, last_email_update__lte=self.start-diff)
+        qs = Profile.objects.filter(due, user__is_active=True).\
+                exclude(user__email='').select_related('user').order_by('user')
+        if self.emails:
+            qs = qs.filter(user__email__in=self.emails)
+        if shards > 1:
+            qs = qs.extra(where=['user_profile.user_id %% %s = %s'],
+                          params=[shards, shard])
+        return qs.iterator()
 
-        profile = user.profile
-        last_sent = profile.last_email_update
+    def update_shard(self, shard, shards):
+        # digests are shared by all the users of an entity that were last
+        # updated at the same time, which after the first run is most of them
+        self.digests = {}
+        self.entities = {}
+        sent = 0
+        profiles = self.get_profiles(shard, shards)
+        while True:
+            batch = list(itertools.islice(profiles, self.batch_size))
+            if not batch:
+                break
+            sent += self.update_batch(batch)
+        self.stdout.write("> shard %d/%d sent %d updates\n" % (shard+1, shards, sent))
+
+    def update_batch(self, profiles):
+        ''' renders and sends the updates of a batch of users, returns the
+            number of updates sent '''
+        user_ids = [p.user_id for p in profiles]
+        memberships = {}
+        for user_id, entity_id, can_answer in Membership.objects.\
+                filter(user__in=user_ids).values_list('user', 'entity', 'can_answer'):
+            memberships.setdefault(user_id, []).append((entity_id, can_answer))
+        follows = {}
+        for user_id, object_id in Follow.objects.\
+                filter(user__in=user_ids, content_type=self.q_ct).\
+                values_list('user', 'object_id'):
+            follows.setdefault(user_id, set()).add(int(object_id))
+        answered = {}
+        for user_id, question_id in Answer.objects.\
+                filter(author__in=user_ids).values_list('author', 'question'):
+            answered.setdefault(user_id, set()).add(question_id)
+        self.load_entities(itertools.chain(*memberships.values()))
+
+        messages = []
+        for profile in profiles:
+            user_memberships = memberships.get(profile.user_id)
+            if not user_memberships:
+                continue
+            html_content = self.render_update(profile, user_memberships,
+                    follows.get(profile.user_id, set()),
+                    answered.get(profile.user_id, set()))
+            # TODO: create a link for the update and send it to shaib
+            text_content = 'Sorry, we only support html based email'
+            msg = EmailMultiAlternatives(self.subject, text_content,
+                    settings.DEFAULT_FROM_EMAIL, [profile.user.email])
+            msg.attach_alternative(html_content, "text/html")
+            messages.append((profile, msg))
+
+        sent = []
+        connection = get_connection()
+        connection.open()
         try:
-            freq = self.diffs[user.profile.email_notification]
-        except KeyError:
-            return
+            for profile, msg in messages:
+                try:
+                    connection.send_messages([msg])
+                except:
+                    ''' probably a bad email '''
+                    continue
+                sent.append(profile.id)
+                self.stdout.write(">>> sent update to %(username)s at %(email)s\n" % \
+                                  profile.user.__dict__)
+        finally:
+            connection.close()
 
-        if self.start-last_sent < freq:
-            ''' don't exceed the frequency! '''
-            return
+        if sent and not settings.DEBUG:
+            Profile.objects.filter(id__in=sent).update(last_email_update=self.start)
+        return len(sent)
 
+    def load_entities(self, memberships):
+        missing = set(entity_id for entity_id, can_answer in memberships) - \
+                  set(self.entities)
+        if missing:
+            self.entities.update(Entity.objects.in_bulk(missing))
+
+    def get_digest(self, entity_id, since):
+        ''' returns the questions and answers of the entity since `since`,
+            computed once per entity and time '''
+        key = (entity_id, since)
+        if key not in self.digests:
+            questions = Question.objects.filter(is_deleted=False, entity=entity_id).\
+                    select_related('author')
+            self.digests[key] = dict(
+                new_questions=list(questions.filter(created_at__gte=since).\
+                                    order_by('author')),
+                old_questions=list(questions.filter(created_at__lt=since).\
+                                    order_by('-rating')),
+                new_answers=list(Answer.objects.filter(created_at__gte=since,
+                        question__entity=entity_id, question__is_deleted=False,
+                        is_deleted=False).select_related('question', 'author').\
+                        order_by('question')),
+                )
+        return self.digests[key]
+
+    def render_update(self, profile, memberships, follows, answered):
+        last_sent = profile.last_email_update
         context = {
-                'ROOT_URL': get_root_url(),
+                'ROOT_URL': self.root_url,
                 'last_sent': last_sent,
-                'is_active': user.is_active,
-                'user': user,
-                'new_questions': {},
-                'old_questions': {},
-                'new_answers': {},
+                'is_active': profile.user.is_active,
+                'user': profile.user,
                 }
-        for entity in profile.entities:
-            if profile.can_answer(entity):
-                ''' handle candidates '''
-                local_qs = Question.objects.filter(is_deleted=False, entity=entity).\
-                        exclude(answers__author=user)
-                context['new_questions'][entity] = local_qs.filter(created_at__gte=last_sent).order_by('updated_at')
-                context['old_questions'][entity] = local_qs.filter(created_at__lt=last_sent).order_by('-rating')
-                html_content = render_to_string("email/candidate_update.html", context)
-            else:
-                ''' handle voters '''
-                # TODO: Develop a template for new upvotes
-                # context['new_upvotes'] = QuestionUpvote.objects.filter(created_at__gte=last_sent, question__author=user).\
-                #        order_by('question')
-                context['new_answers'][entity] = Answer.objects.filter(created_at__gte=last_sent,
-                        question__entity=entity, is_deleted=False,
-                        question__in = [x.actor for x in \
-                                Follow.objects.filter(user=user, content_type=self.q_ct)]).\
-                                order_by('question')
-                context['new_questions'][entity] = Question.objects.exclude(author=user).\
-                        filter(entity=entity, is_deleted=False,
-                               created_at__gte=last_sent).order_by('author')
-                html_content = render_to_string("email/voter_update.html", context)
-
-        subject = FlatBlock.objects.get(slug="candidate_update_email.subject").content
-        # TODO: create a link for the update and send it to shaib
-        text_content = 'Sorry, we only support html based email'
-        # create the email, and attach the HTML version as well.
-        try:
-            msg = EmailMultiAlternatives(subject, text_content,
-                    settings.DEFAULT_FROM_EMAIL, [user.email])
-            msg.attach_alternative(html_content, "text/html")
-            msg.send()
-        except:
-            ''' probably a bad email '''
-            return
-        self.stdout.write(">>> sent update to %(username)s at %(email)s is_active=%(is_active)s" % user.__dict__)
-        if not settings.DEBUG:
-            profile.last_email_update = self.start
-            profile.save()
+        candidate_in = [entity_id for entity_id, can_answer in memberships if can_answer]
+        if candidate_in:
+            ''' handle candidates '''
+            context['new_questions'] = {}
+            context['old_questions'] = {}
+            for entity_id in candidate_in:
+                digest = self.get_digest(entity_id, last_sent)
+                entity = self.entities[entity_id]
+                context['new_questions'][entity] = sorted(
+                        [q for q in digest['new_questions'] if q.id not in answered],
+                        key=lambda q: q.updated_at)
+                context['old_questions'][entity] = \
+                        [q for q in digest['old_questions'] if q.id not in answered]
+            return render_to_string("email/candidate_update.html", context)
+
+        ''' handle voters '''
+        # TODO: Develop a template for new upvotes
+        context['new_questions'] = []
+        context['new_answers'] = []
+        for entity_id, can_answer in memberships:
+            digest = self.get_digest(entity_id, last_sent)
+            context['new_questions'] += [q for q in digest['new_questions']
+                                           if q.author_id != profile.user_id]
+            context['new_answers'] += [a for a in digest['new_answers']
+                                         if a.question_id in follows]
+        return render_to_string("email/voter_update.html", context)
@@ -1,10 +1,13 @@
-from django.db import models, transaction
-from django.dispatch import receiver
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Count
+from django.utils import timezone
+from django.core.cache import cache
+from django.dispatch import receiver, Signal
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext as _
 from django.core.urlresolvers import reverse
 from django.core.validators import MaxLengthValidator
-from taggit.models import TaggedItemBase
+from taggit.models import TaggedItemBase, Tag
 from django.contrib.contenttypes.models import ContentType
 
 from slugify import slugify as unislugify
@@ -12,13 +15,17 @@ from taggit_autosuggest.managers import TaggableManager
 from entities.models import Entity
 from actstream.models import Follow
 
+from oshot.db import PRIMARY
+from qa.caching import bump_entity_version, cache_time
+
 
 MAX_LENGTH_Q_SUBJECT = 140
 MAX_LENGTH_Q_CONTENT = 1000
 MAX_LENGTH_A_SUBJECT = 80
 MAX_LENGTH_A_CONTENT = 1000 
 
-entity_home_key = lambda entity_id: "entity_home_%s" % entity_id
+# sent by `BaseModel.delete`, which only marks the instance as deleted
+post_soft_delete = Signal(providing_args=["instance"])
 
 class BaseModel(models.Model):
     ''' just a common time base for the models
@@ -31,11 +38,14 @@ class BaseModel(models.Model):
         abstract = True
 
     def delete(self, commit=True):
+        was_deleted = self.is_deleted
         self.is_deleted = True
         if commit:
             self.save()
         content_type = ContentType.objects.get_for_model(self)
         Follow.objects.filter(content_type=content_type, object_id=self.id).delete()
+        if not was_deleted:
+            post_soft_delete.send(sender=self.__class__, instance=self)
 
 class TaggedQuestion(TaggedItemBase):
     content_object = models.ForeignKey("Question")
@@ -48,6 +58,15 @@ def can_vote(entity, user):
 
 Entity.add_to_class('can_vote', can_vote)
 
+def upvoted_question_ids(user, **filters):
+    ''' returns the ids of the questions `user` upvoted, narrowed by
+        `filters` on his upvotes, so the vote state of a whole page of
+        questions costs a single query '''
+    if not user.is_authenticated():
+        return frozenset()
+    upvotes = user.upvotes.filter(**filters)
+    return frozenset(upvotes.values_list('question_id', flat=True))
+
 class Question(BaseModel):
 
     # TODO: rename to just `slug`
@@ -72,6 +91,9 @@ class Question(BaseModel):
 
     class Meta:
         unique_together = ('unislug','entity')
+        # for the keyset pagination of `qa.pagination`
+        index_together = [('entity', 'is_deleted', 'rating', 'id'),
+                          ('entity', 'is_deleted', 'created_at', 'id')]
 
     def __unicode__(self):
         return self.subject
@@ -95,11 +117,19 @@ class Question(BaseModel):
         self.unislug = unislugify(self.subject)
         return super(Question, self).save(**kwargs)
 
+    def change_counter(self, field, change):
+        ''' atomically adds `change` to a counter column, without saving the
+            rest of the row. returns the new value '''
+        Question.objects.filter(pk=self.pk).update(**{field: F(field) + change})
+        value = Question.objects.filter(pk=self.pk).values_list(field, flat=True)[0]
+        setattr(self, field, value)
+        # no post_save is sent, but the entity's lists show the counters
+        bump_entity_version(self.entity_id)
+        return value
+
     @transaction.commit_on_success
     def flagged(self):
-        self.flags_count += 1
-        self.save()
-        return self.flags_count
+        return self.change_counter('flags_count', 1)
 
     def can_user_delete(self, user):
         ''' returns whether a secific user can delete the question '''
@@ -110,11 +140,16 @@ class Question(BaseModel):
             return True
         return False
 
-    def can_vote(self, user):
+    def can_vote(self, user, upvoted_ids=None):
         ''' returns whether a secific user can upvote/downvote the question,
-            or neither '''
+            or neither. pass `upvoted_ids` from `upvoted_question_ids` to
+            save a query per question '''
         if self.entity.can_vote(user):
-            if user.upvotes.filter(question=self).exists():
+            if upvoted_ids is not None:
+                upvoted = self.id in upvoted_ids
+            else:
+                upvoted = user.upvotes.filter(question=self).exists()
+            if upvoted:
                 return 'down'
             else:
                 return 'up'
@@ -129,6 +164,9 @@ class Answer(BaseModel):
     # for easy access to current site answers
     objects = models.Manager()
 
+    class Meta:
+        index_together = [('question', 'is_deleted')]
+
     def __unicode__(self):
         return u"%s: %s" % (self.author, self.content[:30])
 
@@ -143,8 +181,199 @@ class QuestionUpvote(BaseModel):
     question = models.ForeignKey(Question, related_name="upvotes")
     user = models.ForeignKey(User, related_name="upvotes")
 
+    class Meta:
+        unique_together = ('question', 'user')
+
 class QuestionFlag(BaseModel):
     question = models.ForeignKey(Question, related_name="flags")
     reporter = models.ForeignKey(User, related_name="flags")
 
-#import signals
+class EntityStats(models.Model):
+    ''' denormalized counters of an entity, kept up to date by the receivers
+        in `qa.signals` so the pages don't have to count rows '''
+    entity = models.OneToOneField(Entity, primary_key=True, related_name="qa_stats")
+    questions_count = models.IntegerField(_("questions"), default=0)
+    answers_count = models.IntegerField(_("answers"), default=0)
+    users_count = models.IntegerField(_("users"), default=0)
+    upvotes_count = models.IntegerField(_("upvotes"), default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # the querysets each counter counts, given an entity id
+    COUNTERS = {
+        'questions_count': lambda entity_id: Question.objects.filter(
+                                entity=entity_id, is_deleted=False),
+        'answers_count': lambda entity_id: Answer.objects.filter(
+                                question__entity=entity_id, is_deleted=False,
+                                question__is_deleted=False),
+        'users_count': lambda entity_id: Entity(
+                                pk=entity_id).membership_set.all(),
+        'upvotes_count': lambda entity_id: QuestionUpvote.objects.filter(
+                                question__entity=entity_id),
+    }
+
+    def __unicode__(self):
+        return unicode(self.entity_id)
+
+    @classmethod
+    def for_entity(cls, entity):
+        ''' returns the counters of an entity, counting them on first use.
+            they're read from the primary, where they're created and
+            updated, as a replica might not have them yet '''
+        entity_id = getattr(entity, 'pk', entity)
+        try:
+            return cls.objects.using(PRIMARY).get(entity=entity_id)
+        except cls.DoesNotExist:
+            return cls.recount(entity_id)
+
+    @classmethod
+    def recount(cls, entity_id, *counters):
+        ''' counts `counters` (default: all of them) from scratch '''
+        if entity_id is None:
+            return
+        counters = counters or cls.COUNTERS.keys()
+        # counted where they're written, even in the views that read replicas
+        values = dict((c, cls.COUNTERS[c](entity_id).using(PRIMARY).count())
+                      for c in counters)
+        sid = transaction.savepoint()
+        try:
+            stats, created = cls.objects.get_or_create(entity_id=entity_id,
+                                                       defaults=values)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # created at the same time by another process
+            transaction.savepoint_rollback(sid)
+            created = False
+        if not created:
+            values['updated_at'] = timezone.now()
+            cls.objects.filter(entity=entity_id).update(**values)
+            stats = cls.objects.using(PRIMARY).get(entity=entity_id)
+        return stats
+
+    @classmethod
+    def change(cls, entity_id, **deltas):
+        ''' atomically adds `deltas` to the counters, e.g.
+            `EntityStats.change(1, answers_count=1)` '''
+        if entity_id is None:
+            return
+        values = dict((c, F(c) + d) for c, d in deltas.items())
+        values['updated_at'] = timezone.now()
+        if not cls.objects.filter(entity=entity_id).update(**values):
+            cls.recount(entity_id)
+
+class EntityTag(models.Model):
+    ''' the number of the entity's questions tagged with a tag, kept up to
+        date by the receivers in `qa.signals` for the entity's tag cloud '''
+    entity = models.ForeignKey(Entity, related_name="qa_tags")
+    tag = models.ForeignKey(Tag, related_name="entity_counts")
+    num_times = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('entity', 'tag')
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.tag_id, self.num_times)
+
+    @classmethod
+    def cloud(cls, entity_id):
+        ''' returns the entity's tags, most used first, with `num_times` '''
+        tags = []
+        for entity_tag in cls.objects.filter(entity=entity_id, num_times__gt=0).\
+                select_related('tag').order_by('-num_times', 'tag__slug'):
+            entity_tag.tag.num_times = entity_tag.num_times
+            tags.append(entity_tag.tag)
+        return tags
+
+    @classmethod
+    def counted(cls, entity_id, tag_ids=None):
+        ''' returns {tag id: questions count} counted from scratch '''
+        tagged = TaggedQuestion.objects.filter(content_object__entity=entity_id,
+                                               content_object__is_deleted=False)
+        if tag_ids is not None:
+            tagged = tagged.filter(tag__in=tag_ids)
+        return dict(tagged.values_list('tag').annotate(Count('id')).\
+                        order_by())
+
+    @classmethod
+    def recount(cls, entity_id):
+        ''' counts the entity's tag cloud from scratch '''
+        if entity_id is None:
+            return
+        cls.objects.filter(entity=entity_id).delete()
+        cls.objects.bulk_create([cls(entity_id=entity_id, tag_id=tag_id,
+                                     num_times=num_times)
+                    for tag_id, num_times in cls.counted(entity_id).items()])
+
+    @classmethod
+    def change(cls, entity_id, tag_ids, change):
+        ''' atomically adds `change` to the counts of `tag_ids` '''
+        if entity_id is None or not tag_ids:
+            return
+        counts = cls.objects.filter(entity=entity_id, tag__in=tag_ids)
+        if counts.update(num_times=F('num_times') + change) < len(tag_ids):
+            # new to the entity, count these
+            missing = set(tag_ids) - set(counts.values_list('tag', flat=True))
+            counted = cls.counted(entity_id, missing)
+            for tag_id in missing:
+                cls.objects.get_or_create(entity_id=entity_id, tag_id=tag_id,
+                        defaults={'num_times': counted.get(tag_id, 0)})
+
+class LocalityStats(models.Model):
+    ''' the CBS statistics of a locality, keyed by its entity's code.
+        loaded by the `load_cbs_stats` command '''
+    code = models.CharField(max_length=25, primary_key=True)
+    totalpopulation = models.IntegerField(default=0)
+    numofcouncilman = models.CharField(max_length=10, blank=True)
+    socioeco = models.CharField(max_length=10, blank=True)
+    voting = models.CharField(max_length=10, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return self.code
+
+    @staticmethod
+    def cache_key(code):
+        return 'locality_stats_%s' % code
+
+    @classmethod
+    def for_code(cls, code):
+        ''' returns the stats of the locality, or empty ones if it has none '''
+        key = cls.cache_key(code)
+        stats = cache.get(key)
+        if stats is None:
+            try:
+                stats = cls.objects.get(code=code)
+            except cls.DoesNotExist:
+                stats = cls(code=code)
+            cache.set(key, stats, cache_time())
+        return stats
+
+    @classmethod
+    @transaction.commit_on_success
+    def load(cls, rows):
+        ''' replaces the stats with `rows`, a {code: {field: value}} dict '''
+        codes = set(cls.objects.values_list('code', flat=True)) | set(rows)
+        cls.objects.all().delete()
+        cls.objects.bulk_create([cls(code=code,
+                    totalpopulation=int(row.get('totalpopulation') or 0),
+                    numofcouncilman=row.get('numofcouncilman', ''),
+                    socioeco=row.get('socioeco', ''),
+                    voting=row.get('voting', ''))
+                for code, row in rows.items()])
+        cache.delete_many([cls.cache_key(code) for code in codes])
+        return len(rows)
+
+class IndexQueue(models.Model):
+    ''' the objects waiting for `qa.indexing.flush` to index or remove them
+        from the search index. an object is queued once, no matter how many
+        times it changes before the flush '''
+    model = models.CharField(max_length=50)
+    object_id = models.IntegerField()
+    queued_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('model', 'object_id')
+
+    def __unicode__(self):
+        return u"%s.%s" % (self.model, self.object_id)
+
+import signals
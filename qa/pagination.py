@@ -0,0 +1,60 @@
+''' keyset (a.k.a cursor) pagination of the questions lists
+
+    instead of an OFFSET, that makes the database walk over all the previous
+    pages, a page starts right after the (value, id) of the last question of
+    the previous page - the cursor. with the matching indexes on Question
+    every page costs the same.
+'''
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+# the column each order pages over, the id breaks the ties
+KEYSETS = {'rating': 'rating', 'date': 'created_at'}
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        delta = value - EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return value
+
+def _decode(field, value):
+    value = int(value)
+    if field == 'created_at':
+        return EPOCH + datetime.timedelta(microseconds=value)
+    return value
+
+def encode_cursor(question, order):
+    ''' returns the cursor of the page following `question` '''
+    field = KEYSETS[order]
+    return '%d_%d' % (_encode(getattr(question, field)), question.id)
+
+def decode_cursor(cursor, order):
+    ''' returns the (value, id) of a cursor, raises ValueError if bad '''
+    value, id = cursor.split('_', 1)
+    return _decode(KEYSETS[order], value), int(id)
+
+def keyset_page(queryset, order, cursor=None, size=20):
+    ''' returns a list of up to `size` questions from `queryset`, starting
+        after `cursor`, and the cursor of the next page or None if it's the
+        last one. a bad cursor starts from the first page '''
+    field = KEYSETS[order]
+    queryset = queryset.order_by('-%s' % field, '-id')
+    if cursor:
+        try:
+            value, id = decode_cursor(cursor, order)
+        except ValueError:
+            pass
+        else:
+            # the first filter bounds the index scan, the second skips the
+            # ties that were on the previous page
+            queryset = queryset.filter(**{'%s__lte' % field: value}).\
+                        filter(Q(**{'%s__lt' % field: value}) |
+                               Q(**{field: value, 'id__lt': id}))
+    page = list(queryset[:size + 1])
+    if len(page) > size:
+        return page[:size], encode_cursor(page[size - 1], order)
+    return page, None
@@ -0,0 +1,122 @@
+''' cached place searches
+
+    `PlaceSearchForm` normalizes the query and wraps the results of the
+    search in `CachedSearchResults`, which caches the hits count and every
+    page the paginator asks for as the results' models and primary keys.
+    the keys include the place's search version (see `qa.caching`), which
+    `qa.indexing.flush` and `reindex_search` bump, so a cached search lasts
+    until the place's index changes or `SEARCH_CACHE_TIME` passes.
+
+    the results are hydrated with a query per model, including what the
+    search template shows of them, instead of a query per result. a result
+    whose object was deleted since it was indexed is kept, without it, so
+    every page has the results the count promises.
+'''
+import hashlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import get_model
+from django.utils.encoding import smart_str
+
+from haystack import connections
+from haystack.forms import ModelSearchForm
+from haystack.models import SearchResult
+from haystack.query import EmptySearchQuerySet
+
+from qa.caching import search_version
+
+def normalize_query(q):
+    ''' returns the query in lower case with single spaces, so the ways to
+        write the same search share the cache '''
+    return u' '.join(q.lower().split())
+
+def hydrate_queryset(model, using='default'):
+    ''' returns the queryset the search results of `model` are loaded from,
+        the objects still in the index with what the template shows of them '''
+    index = connections[using].get_unified_index().get_index(model)
+    queryset = index.index_queryset(using=using)
+    if model._meta.module_name == 'question':
+        return queryset.prefetch_related('tags', 'answers__author')
+    return queryset.select_related('question__author').\
+                prefetch_related('question__tags', 'question__answers__author')
+
+class HydratedResult(SearchResult):
+    ''' a search result whose object was loaded with the others, None if it
+        was deleted since '''
+    def _get_object(self):
+        return self._object
+
+    object = property(_get_object, SearchResult._set_object)
+
+def hydrate(found, using='default'):
+    ''' returns the search results of `found`, a list of (app_label,
+        model_name, pk, score), with their objects loaded in bulk '''
+    by_model = defaultdict(list)
+    for app_label, model_name, pk, score in found:
+        by_model[(app_label, model_name)].append(pk)
+    objects = {}
+    for (app_label, model_name), pks in by_model.items():
+        model = get_model(app_label, model_name)
+        for obj in hydrate_queryset(model, using).filter(pk__in=pks):
+            objects[(app_label, model_name, unicode(obj.pk))] = obj
+    results = []
+    for app_label, model_name, pk, score in found:
+        result = HydratedResult(app_label, model_name, pk, score)
+        result._object = objects.get((app_label, model_name, unicode(pk)))
+        results.append(result)
+    return results
+
+
+class CachedSearchResults(object):
+    ''' the results of a search query set, cached per slice.
+
+        quacks enough like a query set for the paginator.
+    '''
+    def __init__(self, searchqueryset, key):
+        self.searchqueryset = searchqueryset
+        self.key = key
+
+    def count(self):
+        key = '%s_count' % self.key
+        hits = cache.get(key)
+        if hits is None:
+            hits = self.searchqueryset.count()
+            cache.set(key, hits, settings.SEARCH_CACHE_TIME)
+        return hits
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            return self[k:k + 1][0]
+        key = '%s_%s_%s' % (self.key, k.start, k.stop)
+        found = cache.get(key)
+        if found is None:
+            found = [(r.app_label, r.model_name, r.pk, r.score)
+                     for r in self.searchqueryset[k]]
+            cache.set(key, found, settings.SEARCH_CACHE_TIME)
+        return hydrate(found, self.searchqueryset.query._using)
+
+
+class PlaceSearchForm(ModelSearchForm):
+    ''' a search in `place`, an entity slug, or in all of them if it's empty.
+        use it with `load_all=False`, the cached results are loaded in bulk '''
+    def __init__(self, *args, **kwargs):
+        self.place = kwargs.pop('place', u'')
+        super(PlaceSearchForm, self).__init__(*args, **kwargs)
+
+    def clean_q(self):
+        return normalize_query(self.cleaned_data.get('q', u''))
+
+    def search(self):
+        searchqs = super(PlaceSearchForm, self).search()
+        if isinstance(searchqs, EmptySearchQuerySet):
+            return searchqs
+        query = u'%s|%s|%s' % (self.place, self.cleaned_data['q'],
+                               ','.join(sorted(self.cleaned_data['models'])))
+        key = 'search_%s_%s' % (search_version(self.place),
+                                hashlib.md5(smart_str(query)).hexdigest())
+        return CachedSearchResults(searchqs, key)
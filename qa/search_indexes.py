@@ -1,32 +1,38 @@
 import datetime
 from haystack import indexes
-from celery_haystack.indexes import CelerySearchIndex
 from models import Question, Answer
 
-class AnswerIndex(CelerySearchIndex, indexes.Indexable):
+# the indexes are kept up to date by `qa.indexing`. they load whole rows, as
+# haystack tells the documents' models by their class and only() subclasses it.
+# a question might have no entity, and then its documents have no place
+
+class AnswerIndex(indexes.SearchIndex, indexes.Indexable):
     text = indexes.CharField(document=True, use_template=True)
     author = indexes.CharField(model_attr='author')
     created_at = indexes.DateTimeField(model_attr='created_at')
-    place = indexes.CharField(model_attr='question__entity__slug')
+    place = indexes.CharField(model_attr='question__entity__slug', null=True)
 
     def get_model(self):
         return Answer
 
     def index_queryset(self, **kwargs):
         """Used when the entire index for model is updated."""
-        return self.get_model().objects.all()
+        return self.get_model().objects.filter(is_deleted=False,
+                    question__is_deleted=False).\
+                select_related('author', 'question__entity')
 
-class QuestionIndex(CelerySearchIndex, indexes.Indexable):
+class QuestionIndex(indexes.SearchIndex, indexes.Indexable):
     text = indexes.CharField(document=True, use_template=True)
     # text = indexes.CharField(model_attr='subject')
     author = indexes.CharField(model_attr='author')
     created_at = indexes.DateTimeField(model_attr='created_at')
-    place = indexes.CharField(model_attr='entity__slug')
+    place = indexes.CharField(model_attr='entity__slug', null=True)
 
     def get_model(self):
         return Question
 
     def index_queryset(self, **kwargs):
         """Used when the entire index for model is updated."""
-        return self.get_model().objects.all()
+        return self.get_model().objects.filter(is_deleted=False).\
+                select_related('author', 'entity')
 
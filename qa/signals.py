@@ -0,0 +1,239 @@
+from django.conf import settings
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete, post_init,\
+        pre_save
+
+from qa.models import Question, Answer, QuestionUpvote, TaggedQuestion,\
+        EntityStats, EntityTag, post_soft_delete
+from qa.caching import bump_entity_version, bump_question_version,\
+        bump_sitemap_version, bump_search_version
+from qa import leaderboard
+from entities.models import Entity
+from user.models import Membership
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    bump_entity_version(instance.entity_id)
+    # the entity might have gained or lost its section
+    bump_sitemap_version()
+
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+@receiver(post_save, sender=QuestionUpvote)
+@receiver(post_delete, sender=QuestionUpvote)
+def question_child_changed(sender, instance, **kwargs):
+    try:
+        question = instance.question
+    except Question.DoesNotExist: # deleted along with its question
+        return
+    bump_entity_version(question.entity_id)
+    bump_question_version(question.id)
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def membership_changed(sender, instance, **kwargs):
+    bump_entity_version(instance.entity_id)
+
+''' entity counters
+
+    the counters of the questions and answers change when they're created,
+    deleted or undeleted, so their `is_deleted` is remembered from when they
+    were loaded
+'''
+
+@receiver(post_init, sender=Question)
+@receiver(post_init, sender=Answer)
+def remember_deleted(sender, instance, **kwargs):
+    # not known if deferred
+    instance._was_deleted = instance.__dict__.get('is_deleted')
+
+@receiver(pre_save, sender=Question)
+@receiver(pre_save, sender=Answer)
+def save_deleted(sender, instance, **kwargs):
+    instance._saved_was_deleted = getattr(instance, '_was_deleted', None)
+    instance._was_deleted = instance.is_deleted
+
+def live_change(instance, created):
+    ''' returns how a save changed the number of the live instances, 1, -1
+        or 0, or None if it isn't known '''
+    if created:
+        return 0 if instance.is_deleted else 1
+    was_deleted = getattr(instance, '_saved_was_deleted', None)
+    if was_deleted is None:
+        return None
+    return int(was_deleted) - int(instance.is_deleted)
+
+@receiver(post_save, sender=Question)
+def count_question(sender, instance, created, **kwargs):
+    change = live_change(instance, created)
+    if change is None:
+        EntityStats.recount(instance.entity_id, 'questions_count',
+                            'answers_count')
+    elif change:
+        # (un)deleting a question takes its live answers along
+        answers = 0 if created else \
+                    instance.answers.filter(is_deleted=False).count()
+        EntityStats.change(instance.entity_id, questions_count=change,
+                           answers_count=change * answers)
+
+@receiver(post_delete, sender=Question)
+def uncount_question(sender, instance, **kwargs):
+    EntityStats.recount(instance.entity_id)
+    EntityTag.recount(instance.entity_id)
+    leaderboard.recount_entity(instance.entity_id)
+
+@receiver(post_save, sender=Answer)
+def count_answer(sender, instance, created, **kwargs):
+    question = instance.question
+    change = live_change(instance, created)
+    if change is None:
+        EntityStats.recount(question.entity_id, 'answers_count')
+    elif change and not question.is_deleted:
+        EntityStats.change(question.entity_id, answers_count=change)
+
+@receiver(post_delete, sender=Answer)
+def uncount_answer(sender, instance, **kwargs):
+    try:
+        EntityStats.recount(instance.question.entity_id, 'answers_count')
+    except Question.DoesNotExist: # recounted when its question is deleted
+        pass
+
+@receiver(post_save, sender=QuestionUpvote)
+def count_upvote(sender, instance, created, **kwargs):
+    if created:
+        EntityStats.change(instance.question.entity_id, upvotes_count=1)
+
+@receiver(post_delete, sender=QuestionUpvote)
+def uncount_upvote(sender, instance, **kwargs):
+    try:
+        EntityStats.change(instance.question.entity_id, upvotes_count=-1)
+    except Question.DoesNotExist:
+        pass
+
+@receiver(post_save, sender=Membership)
+def count_member(sender, instance, created, **kwargs):
+    if created:
+        EntityStats.change(instance.entity_id, users_count=1)
+
+@receiver(post_delete, sender=Membership)
+def uncount_member(sender, instance, **kwargs):
+    EntityStats.change(instance.entity_id, users_count=-1)
+
+''' tag clouds '''
+
+@receiver(post_save, sender=TaggedQuestion)
+def count_tag(sender, instance, created, **kwargs):
+    if created:
+        question = instance.content_object
+        if not question.is_deleted:
+            EntityTag.change(question.entity_id, [instance.tag_id], 1)
+        bump_entity_version(question.entity_id)
+
+@receiver(post_delete, sender=TaggedQuestion)
+def uncount_tag(sender, instance, **kwargs):
+    try:
+        question = instance.content_object
+    except Question.DoesNotExist: # recounted when its question is deleted
+        return
+    if not question.is_deleted:
+        EntityTag.change(question.entity_id, [instance.tag_id], -1)
+    bump_entity_version(question.entity_id)
+
+@receiver(post_soft_delete, sender=Question)
+def uncount_question_tags(sender, instance, **kwargs):
+    EntityTag.change(instance.entity_id,
+                     list(instance.tags.values_list('id', flat=True)), -1)
+
+@receiver(post_save, sender=Question)
+def count_undeleted_question_tags(sender, instance, created, **kwargs):
+    if not created and live_change(instance, created) == 1:
+        EntityTag.change(instance.entity_id,
+                         list(instance.tags.values_list('id', flat=True)), 1)
+
+''' the candidates' leaderboard '''
+
+@receiver(post_save, sender=Answer)
+def count_candidate_answer(sender, instance, created, **kwargs):
+    question = instance.question
+    if not created:
+        leaderboard.recount(instance.author_id, question.entity_id)
+    elif not instance.is_deleted and not question.is_deleted:
+        leaderboard.change(instance.author_id, question.entity_id, 1)
+
+@receiver(post_delete, sender=Answer)
+def uncount_candidate_answer(sender, instance, **kwargs):
+    try:
+        leaderboard.recount(instance.author_id, instance.question.entity_id)
+    except Question.DoesNotExist: # recounted when its question is deleted
+        pass
+
+@receiver(post_soft_delete, sender=Question)
+def uncount_question_answers(sender, instance, **kwargs):
+    for author_id in set(instance.answers.values_list('author', flat=True)):
+        leaderboard.recount(author_id, instance.entity_id)
+
+@receiver(post_save, sender=Question)
+def count_undeleted_question_answers(sender, instance, created, **kwargs):
+    if not created and live_change(instance, created) == 1:
+        uncount_question_answers(sender, instance)
+
+@receiver(post_init, sender=Membership)
+def remember_member_of(sender, instance, **kwargs):
+    instance._was_member_of_id = instance.__dict__.get('member_of_id')
+
+@receiver(post_save, sender=Membership)
+def count_member_answers(sender, instance, **kwargs):
+    if instance.can_answer:
+        leaderboard.recount(instance.user_id, instance.entity_id)
+    # the list the member left
+    was_member_of_id = getattr(instance, '_was_member_of_id', None)
+    if was_member_of_id and was_member_of_id != instance.member_of_id:
+        leaderboard.recount_list(was_member_of_id)
+    instance._was_member_of_id = instance.member_of_id
+
+@receiver(post_delete, sender=Membership)
+def uncount_member_answers(sender, instance, **kwargs):
+    if instance.member_of_id:
+        leaderboard.recount_list(instance.member_of_id)
+
+''' search indexing '''
+
+# the fields of a question its answers' documents depend on
+ANSWERS_DEPEND_ON = ('subject', 'entity_id', 'is_deleted')
+
+def answers_state(question):
+    ''' the values of the question's fields its answers' documents depend on,
+        None if any of them was deferred '''
+    if not all(f in question.__dict__ for f in ANSWERS_DEPEND_ON):
+        return None
+    return [question.__dict__[f] for f in ANSWERS_DEPEND_ON]
+
+@receiver(post_init, sender=Question)
+def remember_indexed_fields(sender, instance, **kwargs):
+    # `qa.indexing.BatchedSignalProcessor` reindexes the answers if they change
+    instance._indexed_answers_state = answers_state(instance)
+
+BATCHED_PROCESSOR = 'qa.indexing.BatchedSignalProcessor'
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def invalidate_searches(sender, instance, **kwargs):
+    # the batched index is changed by `qa.indexing.flush`, which bumps them
+    # once it did. an index that's updated right away, or never, has only
+    # this bump
+    if getattr(settings, 'HAYSTACK_SIGNAL_PROCESSOR', None) == BATCHED_PROCESSOR:
+        return
+    if sender is Question:
+        if instance.entity_id is None:
+            places = [u'']
+        else:
+            places = Entity.objects.filter(pk=instance.entity_id).\
+                        values_list('slug', flat=True)
+    else:
+        places = Question.objects.filter(pk=instance.question_id).\
+                    values_list('entity__slug', flat=True)
+    # all of them, if it was deleted along with its question or entity
+    bump_search_version((places[0] or u'') if places else None)
@@ -1,21 +1,117 @@
-from django.contrib.sitemaps import GenericSitemap
+''' the sitemaps
+
+    the questions are partitioned by entity, every entity with live questions
+    has a section in the sitemap index, listed with each of its pages. a
+    section is rendered from just the columns its urls need and cached as an
+    entity fragment (see `qa.caching`), so it's rebuilt only after one of the
+    entity's questions changes.
+'''
+from django.contrib.sitemaps import Sitemap
 from django.contrib.auth.models import User
-from django.contrib.auth.models import Group
+from django.contrib.sites.models import get_current_site
+from django.core.cache import cache
+from django.core.paginator import EmptyPage
+from django.core.urlresolvers import reverse
+from django.db.models import Count
+from django.http import HttpResponse, Http404
+from django.template.loader import render_to_string
+
 from qa.models import Question
+from qa.caching import entity_fragment, sitemap_version, cache_time
+
+class QuestionSitemap(Sitemap):
+    ''' the live questions of an entity '''
+    priority = 1
+    changefreq = 'hourly'
+
+    def __init__(self, entity_id):
+        self.entity_id = entity_id
+
+    def items(self):
+        return Question.objects.filter(entity=self.entity_id, is_deleted=False).\
+                    order_by('id').values_list('unislug', 'updated_at')
+
+    def location(self, item):
+        return reverse('question_detail', kwargs={'entity_id': self.entity_id,
+                                                  'slug': item[0]})
+
+    def lastmod(self, item):
+        return item[1]
+
+
+class CandidateSitemap(Sitemap):
+    priority = 0.6
+    changefreq = 'weekly'
+
+    def items(self):
+        return User.objects.filter(groups__name='candidates').\
+                    order_by('id').only('username', 'last_login')
+
+    def lastmod(self, item):
+        return item.last_login
+
+
+def get_sitemap(section):
+    ''' returns the sitemap of the section and the entity it's cached in '''
+    if section == 'candidates':
+        return CandidateSitemap(), None
+    try:
+        kind, entity_id = section.split('-', 1)
+        entity_id = int(entity_id)
+    except ValueError:
+        raise Http404("No sitemap available for section: %r" % section)
+    if kind != 'questions':
+        raise Http404("No sitemap available for section: %r" % section)
+    return QuestionSitemap(entity_id), entity_id
 
-candidate_group = Group.objects.filter(name='candidates')
+def index(request):
+    ''' the sitemap index, one section per entity that has live questions '''
+    site = get_current_site(request)
+    protocol = 'https' if request.is_secure() else 'http'
+    key = 'sitemap_index_%s_%s' % (protocol, sitemap_version())
+    content = cache.get(key)
+    if content is None:
+        # the sections and their number of pages, of `Sitemap.limit` urls
+        sections = [('candidates', CandidateSitemap().paginator.num_pages)]
+        for entity_id, questions in Question.objects.filter(is_deleted=False).\
+                exclude(entity=None).order_by('entity').values_list('entity').\
+                annotate(Count('id')):
+            sections.append(('questions-%d' % entity_id,
+                             (questions - 1) // QuestionSitemap.limit + 1))
+        sitemaps = []
+        for section, pages in sections:
+            url = '%s://%s%s' % (protocol, site.domain,
+                    reverse('sitemap_section', kwargs={'section': section}))
+            sitemaps.append(url)
+            sitemaps += ['%s?p=%d' % (url, page) for page in range(2, pages + 1)]
+        content = render_to_string('sitemap_index.xml', {'sitemaps': sitemaps})
+        cache.set(key, content, cache_time())
+    return HttpResponse(content, content_type='application/xml')
 
-question_dict = {
-    'queryset': Question.objects.all(),
-    'date_field': 'updated_at',
-}
+def sitemap(request, section):
+    ''' a section of the sitemap, rendered once per version of its entity '''
+    sitemap, entity_id = get_sitemap(section)
+    site = get_current_site(request)
+    protocol = 'https' if request.is_secure() else 'http'
+    try:
+        page = int(request.GET.get('p', 1))
+    except ValueError:
+        raise Http404("No page '%s'" % request.GET['p'])
 
-candidate_dict = {
-    'queryset': User.objects.filter(groups__in=candidate_group),
-    'date_field': 'last_login',
-}
+    def render():
+        try:
+            urls = sitemap.get_urls(page=page, site=site, protocol=protocol)
+        except EmptyPage:
+            raise Http404("Page %s empty" % page)
+        return render_to_string('sitemap.xml', {'urlset': urls})
 
-sitemaps = {
-    'questions': GenericSitemap(question_dict, priority=1, changefreq='hourly'),
-    'candidates': GenericSitemap(candidate_dict, priority=0.6, changefreq='weekly'),
-}
+    name = 'sitemap_%s_%s' % (protocol, page)
+    if entity_id is None:
+        key = '%s_%s' % (section, name)
+        content = cache.get(key)
+        if content is None:
+            content = render()
+            cache.set(key, content, cache_time())
+    else:
+        content = entity_fragment(entity_id, name, render)
+    return HttpResponse(content, content_type='application/xml')
@@ -1,8 +1,10 @@
 import httplib
+import time
+from contextlib import contextmanager
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.contrib.sites.models import Site
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
@@ -17,6 +19,9 @@ from social_auth.models import UserSocialAuth
 from actstream.models import Follow
 
 from oshot.utils import get_root_url
+from qa.models import Question, QuestionUpvote, Answer
+from qa import indexing
+from user.models import Membership
 
 logger = get_task_logger(__name__)
 
@@ -30,8 +35,29 @@ def get_graph_api(user):
 def get_full_url(path):
     return 'http://%s%s' % (Site.objects.get_current().domain,path)
 
-@task(max_retries=3, default_retry_delay=10)
-def publish_question_to_facebook(question):
+def load(model, id, *related):
+    ''' reloads the object the task was queued for, None if it's gone '''
+    try:
+        return model.objects.select_related(*related).get(id=id)
+    except model.DoesNotExist:
+        logger.info("%s %s no longer exists" % (model.__name__, id))
+        return None
+
+@contextmanager
+def timed(stage):
+    ''' logs how long the wrapped stage took '''
+    start = time.time()
+    try:
+        yield
+    finally:
+        logger.info("%s took %.3f seconds" % (stage, time.time() - start))
+
+@task(max_retries=3, default_retry_delay=10,
+      rate_limit=settings.FACEBOOK_RATE_LIMIT, serializer='json')
+def publish_question_to_facebook(question_id):
+    question = load(Question, question_id, 'author', 'entity')
+    if not question:
+        return
     graph = get_graph_api(question.author)
     if graph:
         question_url = get_full_url(question.get_absolute_url())
@@ -41,8 +67,12 @@ def publish_question_to_facebook(question):
             logger.warn("failed to publish question to facebook %s" % unicode(question))
             publish_question_to_facebook.retry(exc=exc)
 
-@task(max_retries=3, default_retry_delay=10)
-def publish_upvote_to_facebook(upvote):
+@task(max_retries=3, default_retry_delay=10,
+      rate_limit=settings.FACEBOOK_RATE_LIMIT, serializer='json')
+def publish_upvote_to_facebook(upvote_id):
+    upvote = load(QuestionUpvote, upvote_id, 'user', 'question__entity')
+    if not upvote:
+        return
     graph = get_graph_api(upvote.user)
     if graph:
         question_url = get_full_url(upvote.question.get_absolute_url())
@@ -52,34 +82,80 @@ def publish_upvote_to_facebook(upvote):
             logger.warn("failed to publish upvote to facebook")
             publish_upvote_to_facebook.retry(exc=exc)
 
-@task()
-def publish_answer(answer, send_email=True):
-    logger.info("publishing answer %s" % unicode(answer))
-    question = answer.question
-    # publish to facebook
+@task(max_retries=3, default_retry_delay=10,
+      rate_limit=settings.FACEBOOK_RATE_LIMIT, serializer='json')
+def publish_answer_to_facebook(answer_id):
+    answer = load(Answer, answer_id, 'author', 'question__entity')
+    if not answer:
+        return
     graph = get_graph_api(answer.author)
     if graph:
         answer_url = get_full_url(answer.get_absolute_url())
         try:
-            graph.post(path="me/localshot:answer", question=answer_url)
+            with timed("publishing answer %d to facebook" % answer.id):
+                graph.post(path="me/localshot:answer", question=answer_url)
         except Exception, exc:
             logger.warn("-- Failed to publish answer to facebook")
-    if send_email:
-        # send an email to interesed users
-        editors = Membership.objects.filter(entity__in=question.entity,
-                is_editor=True).values_list('profile__user__email', flat=True)
-        content_type = ContentType.objects.get_for_model(question)
-        followers  = Follow.objects.filter(content_type=content_type,
-                object_id=question.id).values_list('user__email', flat=True)
+            publish_answer_to_facebook.retry(exc=exc)
+
+@task(serializer='json')
+def send_answer_emails(answer_id, user_ids):
+    ''' emails the new answer to a chunk of users, over one connection '''
+    answer = load(Answer, answer_id, 'author', 'question__entity')
+    if not answer:
+        return
+    with timed("emailing answer %d to %d users" % (answer.id, len(user_ids))):
+        emails = User.objects.filter(id__in=user_ids, is_active=True).\
+                    exclude(email='').values_list('email', flat=True)
         html_content = render_to_string("email/new_answer.html",
                 {'answer': answer,
                  'ROOT_URL': get_root_url(),
                 })
         text_content = 'Sorry, we only support html based email'
-        msg = EmailMultiAlternatives(_("A new answer for your question"),
-                text_content,
-                settings.DEFAULT_FROM_EMAIL,
-                bcc=list(editors)+list(followers))
-        msg.attach_alternative(html_content, "text/html")
-        msg.send()
+        connection = get_connection()
+        connection.open()
+        try:
+            for email in emails:
+                msg = EmailMultiAlternatives(_("A new answer for your question"),
+                        text_content,
+                        settings.DEFAULT_FROM_EMAIL,
+                        [email],
+                        connection=connection)
+                msg.attach_alternative(html_content, "text/html")
+                try:
+                    msg.send()
+                except Exception:
+                    # a bounce shouldn't stop the rest of the chunk
+                    logger.warn("-- Failed to email answer %d to %s" % (answer.id, email))
+        finally:
+            connection.close()
+
+@task(serializer='json')
+def publish_answer(answer_id, send_email=True):
+    ''' dispatches the publishing of the answer to the subtasks '''
+    answer = load(Answer, answer_id, 'question')
+    if not answer:
+        return
+    logger.info("publishing answer %s" % unicode(answer))
+    publish_answer_to_facebook.delay(answer.id)
+    if not send_email:
+        return
+    with timed("resolving the recipients of answer %d" % answer.id):
+        # send an email to interesed users
+        question = answer.question
+        editors = Membership.objects.filter(entity=question.entity_id,
+                is_editor=True).values_list('user', flat=True)
+        content_type = ContentType.objects.get_for_model(question)
+        followers  = Follow.objects.filter(content_type=content_type,
+                object_id=question.id).values_list('user', flat=True)
+        user_ids = sorted((set(editors) | set(followers)) - set([answer.author_id]))
+    size = settings.ANSWER_EMAIL_BATCH_SIZE
+    for i in range(0, len(user_ids), size):
+        send_answer_emails.delay(answer.id, user_ids[i:i+size])
 
+@task(serializer='json')
+def flush_search_index():
+    ''' indexes the objects queued by `qa.indexing` since the last flush '''
+    with timed("flushing the search index queue"):
+        count = indexing.flush()
+    logger.info("flushed %d objects to the search index" % count)
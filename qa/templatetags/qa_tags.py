@@ -14,6 +14,13 @@ def can_upvote(self, user):
 def can_downvote(self, user):
     return self.can_vote(user) == "down"
 
+@register.assignment_tag(takes_context=True)
+def vote_state(context, question):
+    ''' returns 'up', 'down' or None for the current user, using the
+        `upvoted_ids` a list view put in the context when there is one '''
+    return question.can_vote(context['user'],
+                             upvoted_ids=context.get('upvoted_ids'))
+
 @register.filter
 def can_delete(self, user):
     return self.can_user_delete(user)
@@ -1,19 +1,27 @@
 import json
+import os
+import tempfile
 
 from django.conf import settings
 from django.contrib.auth.models import User, AnonymousUser
 from social_auth.tests.client import SocialClient
 from django.test.client import Client
 from django.core.urlresolvers import reverse
+from django.core import mail
+from django.core.management import call_command
 from django.utils import translation
 from django.test import TestCase
 from django.test.utils import override_settings
 
-from mock import patch
+from mock import patch, Mock
+from flatblocks.models import FlatBlock
+from haystack import connections
+from actstream import follow
 from entities.models import Domain, Division, Entity
 from polyorg.models import CandidateList
 from user.models import Membership
 from .models import *
+from .pagination import keyset_page
 
 
 # @override_settings(TEST_RUNNER='djcelery.contrib.test_runner.CeleryTestSuiteRunner')
@@ -121,6 +129,126 @@ class QuestionTest(TestCase):
         self.q.is_deleted = False
         self.q.save()
 
+    def test_entity_stats(self):
+        stats = EntityStats.for_entity(self.home)
+        self.assertEquals(stats.questions_count, 1)
+        self.assertEquals(stats.answers_count, 1)
+        self.assertEquals(stats.users_count, 4)
+        self.assertEquals(stats.upvotes_count, 0)
+        QuestionUpvote.objects.create(question=self.q, user=self.common2_user)
+        self.q.delete()
+        stats = EntityStats.for_entity(self.home)
+        self.assertEquals(stats.questions_count, 0)
+        self.assertEquals(stats.answers_count, 0)
+        self.assertEquals(stats.upvotes_count, 1)
+        # saving it again doesn't count it again
+        self.q.save()
+        self.assertEquals(EntityStats.for_entity(self.home).questions_count, 0)
+        self.q.is_deleted = False
+        self.q.save()
+        stats = EntityStats.for_entity(self.home)
+        self.assertEquals(stats.questions_count, 1)
+        self.assertEquals(stats.answers_count, 1)
+        self.common2_user.profile.remove_entity(self.home)
+        self.assertEquals(EntityStats.for_entity(self.home).users_count, 3)
+
+    def test_locality_stats(self):
+        self.assertEquals(LocalityStats.for_code(self.home.code).totalpopulation, 0)
+        LocalityStats.load({"1111": {"totalpopulation": 32768,
+                                     "numofcouncilman": "16", "socioeco": "8"}})
+        stats = LocalityStats.for_code(self.home.code)
+        self.assertEquals(stats.totalpopulation, 32768)
+        self.assertEquals(stats.numofcouncilman, "16")
+        self.assertEquals(stats.voting, "")
+        res = Client().get(reverse('entity_home', args=(self.home.id, )))
+        self.assertEquals(res.context['stats'].totalpopulation, 32768)
+
+    def test_cursor_pagination(self):
+        for i in range(4):
+            Question.objects.create(author=self.common_user, rating=i % 2,
+                            subject="question %d" % i, entity=self.home)
+        questions = Question.objects.filter(entity=self.home, is_deleted=False)
+        for order, key in (('rating', lambda q: (-q.rating, -q.id)),
+                           ('date', lambda q: (-q.id, ))):
+            pages, cursor = [], None
+            while True:
+                page, cursor = keyset_page(questions, order, cursor, size=2)
+                pages += page
+                if not cursor:
+                    break
+            self.assertEquals(pages, sorted(questions, key=key))
+        c = Client()
+        url = reverse('entity_home', args=(self.home.id, ))
+        response = c.get(url, {'format': 'json', 'order': 'date'})
+        data = json.loads(response.content)
+        self.assertEquals(len(data['questions']), 5)
+        self.assertEquals(data['next'], None)
+        response = c.get(url, {'cursor': '', 'order': 'date'})
+        self.assertEquals(len(response.context['questions']), 5)
+        response = c.get(reverse('atom_entity_questions', args=(self.home.id, )))
+        self.assertEquals(response.status_code, 200)
+
+    def test_query_budget(self):
+        from oshot.middleware import QueryBudgetExceeded, samples
+        c = Client()
+        url = reverse('entity_home', args=(self.home.id, ))
+        c.get(url)
+        self.assertTrue(samples['qa.views.entity_home'])
+        with self.settings(QUERY_BUDGETS_STRICT=True,
+                           VIEW_QUERY_BUDGETS={'qa.views.entity_home': 1}):
+            self.assertRaises(QueryBudgetExceeded, c.get, url)
+
+    def test_tag_cloud(self):
+        q2 = Question.objects.create(author=self.common2_user,
+                        subject="who?", entity=self.home)
+        q2.tags.add("abc", "xyz")
+        self.assertEquals([(t.name, t.num_times) for t in EntityTag.cloud(self.home.id)],
+                          [("abc", 2), ("def", 1), ("xyz", 1)])
+        q2.tags.remove("xyz")
+        self.q.delete()
+        self.assertEquals([(t.name, t.num_times) for t in EntityTag.cloud(self.home.id)],
+                          [("abc", 1)])
+        EntityTag.recount(self.home.id)
+        self.assertEquals([(t.name, t.num_times) for t in EntityTag.cloud(self.home.id)],
+                          [("abc", 1)])
+        self.q.is_deleted = False
+        self.q.save()
+        self.assertEquals([(t.name, t.num_times) for t in EntityTag.cloud(self.home.id)],
+                          [("abc", 2), ("def", 1)])
+
+    def test_leaderboard(self):
+        membership = lambda: Membership.objects.get(user=self.candidate_user,
+                                                    entity=self.home)
+        candidate_list = lambda: CandidateList.objects.get(id=self.candidate_list.id)
+        self.assertEquals(membership().answers_count, 1)
+        self.assertEquals(candidate_list().answers_count, 1)
+        q2 = Question.objects.create(author=self.common_user,
+                        subject="when?", entity=self.home)
+        a2 = q2.answers.create(author=self.candidate_user, content="now")
+        self.assertEquals(membership().answers_count, 2)
+        self.assertEquals(candidate_list().answers_count, 2)
+        a2.delete()
+        self.assertEquals(membership().answers_count, 1)
+        self.q.delete()
+        self.assertEquals(membership().answers_count, 0)
+        self.assertEquals(candidate_list().answers_count, 0)
+        c = Client()
+        response = c.get("%s?list=%d" % (reverse('entity_home', args=(self.home.id, )),
+                                          self.candidate_list.id))
+        self.assertEquals([m.user for m in response.context['candidates']],
+                          [self.candidate_user])
+        self.q.is_deleted = False
+        self.q.save()
+        self.assertEquals(candidate_list().answers_count, 1)
+        # moving to another list takes the answers along
+        other_list = CandidateList.objects.create(name="other", ballot="o",
+                                                  entity=self.home)
+        moved = membership()
+        moved.member_of = other_list
+        moved.save()
+        self.assertEquals(candidate_list().answers_count, 0)
+        self.assertEquals(CandidateList.objects.get(id=other_list.id).answers_count, 1)
+
     def test_question_detail(self):
         c = Client()
         q_url = reverse('question_detail',
@@ -134,13 +262,24 @@ class QuestionTest(TestCase):
         response = c.get(q_url)
         self.assertEquals(response.status_code, 200)
         self.assertTrue(response.context['can_answer'])
+        self.assertEquals(response.context['my_answer_id'], self.a.id)
+        self.assertEquals(response.context['supporters'](), [self.common_user])
+        version = response.context['question_version']
+        self.q.answers.create(author=self.editor, content="it is flat")
+        response = c.get("%s?answer=%d" % (q_url, self.a.id))
+        self.assertNotEquals(response.context['question_version'], version)
+        self.assertContains(response, "it is flat")
+        self.assertEquals(response.context['fb_message'], self.a.content)
 
     def test_q_flagged(self):
         '''
         test the flagging a question works
         '''
-        self.q.flagged()
+        with patch('qa.models.bump_entity_version') as bump:
+            self.q.flagged()
         self.assertEquals(self.q.flags_count, 1)
+        # the entity's flagged list is cached
+        bump.assert_called_once_with(self.home.id)
 
     def test_flag_as_anonymous(self):
         '''
@@ -301,6 +440,19 @@ class QuestionTest(TestCase):
         self.assertEquals(response.status_code, 403)
         self.assertEquals(response.content, 'You already upvoted this question')
 
+    def test_downvote(self):
+        c = Client()
+        self.assertTrue(c.login(username="commoner2", password="pass"))
+        response = c.post(reverse('upvote_question', kwargs={'q_id':self.q.id}))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, '2')
+        response = c.post(reverse('downvote_question', kwargs={'q_id':self.q.id}))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, '1')
+        response = c.post(reverse('downvote_question', kwargs={'q_id':self.q.id}))
+        self.assertEquals(response.status_code, 403)
+        self.assertEquals(Question.objects.get(pk=self.q.id).rating, 1)
+
     def test_post_question_facebook(self):
         c = SocialClient()
         c.login(self.user, backend='facebook')
@@ -354,6 +506,42 @@ class QuestionTest(TestCase):
             }
         )
 
+    def test_answer_emails(self):
+        from qa.tasks import publish_answer
+        follow(self.common_user, self.q)
+        follow(self.candidate_user, self.q)
+        publish_answer(self.a.id)
+        recipients = sorted(m.to[0] for m in mail.outbox)
+        self.assertEquals(recipients, ["commmon@example.com", "editor@example.com"])
+
+    def test_vote_state(self):
+        QuestionUpvote.objects.create(question=self.q, user=self.common2_user)
+        upvoted_ids = upvoted_question_ids(self.common2_user,
+                                           question__entity=self.home)
+        self.assertEquals(upvoted_ids, set([self.q.id]))
+        self.assertEquals(self.q.can_vote(self.common2_user, upvoted_ids), 'down')
+        self.assertEquals(self.q.can_vote(self.editor,
+                upvoted_question_ids(self.editor)), 'up')
+        self.assertEquals(upvoted_question_ids(AnonymousUser()), set())
+
+        c = Client()
+        self.assertTrue(c.login(username="commoner2", password="pass"))
+        response = c.get(reverse('entity_home', args=(self.home.id, )))
+        self.assertEquals(response.context['upvoted_ids'], set([self.q.id]))
+
+    def test_send_emails(self):
+        FlatBlock.objects.create(slug="candidate_update_email.subject",
+                                 content="updates")
+        call_command('send_emails', batch_size=2)
+        recipients = sorted(m.to[0] for m in mail.outbox)
+        self.assertEquals(recipients, ["candidate@example.com",
+            "commmon2@example.com", "commmon@example.com", "editor@example.com"])
+        # the candidate already answered the only question
+        candidate_mail = [m for m in mail.outbox if m.to == ["candidate@example.com"]][0]
+        self.assertFalse("why?" in candidate_mail.alternatives[0][0])
+        call_command('send_emails')
+        self.assertEquals(len(mail.outbox), 4)
+
     def test_can_delete(self):
         self.assertFalse(self.q.can_user_delete(AnonymousUser()))
         self.assertFalse(self.q.can_user_delete(self.common2_user))
@@ -365,6 +553,217 @@ class QuestionTest(TestCase):
         response = c.get(reverse('atom_entity_questions', args=(self.home.id, )))
         self.assertEquals(response.status_code, 200)
         # TODO: test the result
+        url = reverse('rss_question_answers', args=(self.q.id, ))
+        response = c.get(url)
+        last_modified = response['Last-Modified']
+        response = c.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEquals(response.status_code, 304)
+        url = reverse('question_detail', args=(self.home.id, self.q.unislug))
+        # the tests' dummy cache doesn't keep the version stamps
+        with patch('qa.conditional.question_version', return_value='1'):
+            etag = c.get(url)['ETag']
+            response = c.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 304)
+            self.q.answers.create(author=self.editor, content="it is flat")
+            self.q.flagged()
+            response = c.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 200)
+
+    def test_sitemaps(self):
+        c = Client()
+        response = c.get(reverse('sitemap'))
+        self.assertContains(response, reverse('sitemap_section',
+                                              args=('questions-%d' % self.home.id, )))
+        self.assertNotContains(response, 'questions-%d' % self.away.id)
+        url = reverse('sitemap_section', args=('questions-%d' % self.home.id, ))
+        gone = Question.objects.create(author=self.common_user,
+                        subject="gone?", entity=self.home)
+        gone.delete()
+        response = c.get(url)
+        self.assertContains(response, self.q.get_absolute_url())
+        self.assertNotContains(response, gone.get_absolute_url())
+        self.assertEquals(c.get(reverse('sitemap_section', args=('answers-1', ))).status_code, 404)
+        # the index lists every page of a section
+        Question.objects.create(author=self.common_user, subject="again?",
+                                entity=self.home)
+        with patch('qa.sitemaps.QuestionSitemap.limit', 1):
+            response = c.get(reverse('sitemap'))
+        self.assertContains(response, '%s?p=2' % url)
+        self.assertNotContains(response, '%s?p=3' % url)
+
+    def test_search_queue(self):
+        from qa import indexing
+        indexing.enqueue(Question, [self.q.id])
+        indexing.enqueue(Answer, [self.a.id])
+        indexing.enqueue(Answer, [self.a.id])
+        self.assertEquals(IndexQueue.objects.count(), 2)
+        self.a.delete()
+        with patch('haystack.backends.whoosh_backend.WhooshSearchBackend.update') as update:
+            with patch('haystack.backends.whoosh_backend.WhooshSearchBackend.remove') as remove:
+                self.assertEquals(indexing.flush(), 2)
+        self.assertEquals(update.call_args[0][1], [self.q])
+        remove.assert_called_once_with('qa.answer.%d' % self.a.id)
+        self.assertFalse(IndexQueue.objects.exists())
+        # a question that fails to index doesn't hold back the others, and
+        # one without an entity has no place
+        broken = Question.objects.create(author=self.common_user,
+                                         subject="broken?", entity=self.home)
+        placeless = Question.objects.create(author=self.common_user,
+                                            subject="where?")
+        indexing.enqueue(Question, [self.q.id, broken.id, placeless.id])
+        def update_side_effect(index, objects):
+            if broken in objects:
+                raise Exception("can't index it")
+        with patch('haystack.backends.whoosh_backend.WhooshSearchBackend.update',
+                   side_effect=update_side_effect) as update:
+            self.assertEquals(indexing.flush(), 3)
+        self.assertEquals(update.call_count, 4)
+        self.assertFalse(IndexQueue.objects.exists())
+
+    def test_fts(self):
+        from haystack.inputs import AutoQuery, Exact
+        from haystack.query import SQ
+        from .fts import SQLiteFTSSearchBackend, SQLiteFTSSearchQuery, index_terms
+        self.assertEquals(index_terms(u'\u05d5\u05d1\u05d1\u05d9\u05ea, \u05e6\u05d4"\u05dc'),
+                [u'\u05d5\u05d1\u05d1\u05d9\u05ea', u'\u05d1\u05d1\u05d9\u05ea', u'\u05d1\u05d9\u05ea', u'\u05e6\u05d4\u05dc'])
+        backend = SQLiteFTSSearchBackend('fts',
+                PATH=os.path.join(tempfile.mkdtemp(), 'index.sqlite3'))
+        unified_index = connections['fts'].get_unified_index()
+        self.q.subject = u'\u05d1\u05d9\u05ea \u05e1\u05e4\u05e8?'
+        backend.update(unified_index.get_index(Question), [self.q])
+        backend.update(unified_index.get_index(Answer), [self.a])
+        def search(*filters):
+            query = SQLiteFTSSearchQuery(using='fts')
+            query.backend = backend
+            for query_filter in filters:
+                query.add_filter(query_filter)
+            return [(r.model_name, int(r.pk)) for r in
+                        backend.search(query.build_query())['results']]
+        # "and in the house"
+        self.assertEquals(search(SQ(content=u'\u05d5\u05d1\u05d1\u05d9\u05ea')),
+                          [('question', self.q.id)])
+        self.assertEquals(search(SQ(content='World'),
+                                 SQ(place=Exact(self.home.slug))),
+                          [('answer', self.a.id)])
+        self.assertEquals(search(SQ(content='World'),
+                                 SQ(place=Exact(self.away.slug))), [])
+        self.assertEquals(search(~SQ(place=Exact(self.home.slug))), [])
+        # an auto query's phrases and exclusions
+        self.assertEquals(search(SQ(content=AutoQuery(u'"\u05d1\u05d9\u05ea \u05e1\u05e4\u05e8"'))),
+                          [('question', self.q.id)])
+        self.assertEquals(search(SQ(content=AutoQuery(u'"\u05e1\u05e4\u05e8 \u05d1\u05d9\u05ea"'))), [])
+        self.assertEquals(search(SQ(content=AutoQuery(u'"world is round" -\u05d1\u05d9\u05ea'))),
+                          [('answer', self.a.id)])
+        self.assertEquals(search(SQ(content=AutoQuery('world -round'))), [])
+        backend.remove(self.a)
+        self.assertEquals(search(SQ(content='world')), [])
+
+    def test_search_hydration(self):
+        from .search import hydrate, normalize_query
+        self.assertEquals(normalize_query(u' Why  IS\tit '), u'why is it')
+        results = hydrate([('qa', 'answer', str(self.a.id), 2.0),
+                           ('qa', 'question', '%d' % (self.q.id + 1000), 1.5),
+                           ('qa', 'question', str(self.q.id), 1.0)])
+        # the deleted question keeps its place on the page
+        self.assertEquals([r.object for r in results], [self.a, None, self.q])
+        self.assertEquals(results[0].score, 2.0)
+
+    def test_search_version(self):
+        from StringIO import StringIO
+        from django.core.cache import get_cache
+        from qa import indexing
+        from .caching import search_version
+        # the tests' dummy cache doesn't keep the version stamps
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        with patch('qa.caching.cache', cache):
+            version = search_version(self.home.slug)
+            away = search_version(self.away.slug)
+            self.assertEquals(search_version(self.home.slug), version)
+            self.q.subject = "why not?"
+            self.q.save()
+            saved = search_version(self.home.slug)
+            self.assertNotEquals(saved, version)
+            self.assertEquals(search_version(self.away.slug), away)
+            with patch('haystack.backends.whoosh_backend.WhooshSearchBackend.update'):
+                indexing.enqueue(Question, [self.q.id])
+                indexing.flush()
+                flushed = search_version(self.home.slug)
+                self.assertNotEquals(flushed, saved)
+                call_command('reindex_search', stdout=StringIO())
+            self.assertNotEquals(search_version(self.home.slug), flushed)
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_replica_reads(self):
+        from django.contrib.sessions.models import Session
+        from oshot.db import ReplicaRouter, use_replicas
+        from .caching import cache_time, fragment_version
+        router = ReplicaRouter()
+        use_replicas(True)
+        try:
+            self.assertEquals(router.db_for_read(Question), 'replica')
+            self.assertEquals(router.db_for_read(Session), None)
+            self.assertEquals(router.db_for_write(Question), 'default')
+            # what's read from a replica is cached apart, and not for long
+            self.assertEquals(cache_time(), settings.REPLICA_CACHE_TIME)
+            self.assertEquals(fragment_version('1'), '1_replica')
+        finally:
+            use_replicas(False)
+        self.assertEquals(router.db_for_read(Question), None)
+        self.assertEquals(cache_time(), settings.LONG_CACHE_TIME)
+        self.assertEquals(fragment_version('1'), '1')
+
+        c = Client()
+        c.login(username="commoner", password="pass")
+        url = reverse('entity_home', args=(self.home.id, ))
+        with patch('oshot.middleware.use_replicas') as use:
+            c.get(url)
+        self.assertIn(((True, ), {}), use.call_args_list)
+        response = c.post(reverse('upvote_question', args=(self.q.id, )))
+        self.assertIn('read_primary', response.cookies)
+        # the same browser reads its upvote from the primary
+        with patch('oshot.middleware.use_replicas') as use:
+            c.get(url)
+        self.assertNotIn(((True, ), {}), use.call_args_list)
+
+    def test_db_pool(self):
+        from oshot.dbpool import ConnectionPool, PoolTimeout
+        pool = ConnectionPool(size=1, timeout=0.01, max_lifetime=60,
+                              check_after=30)
+        self.assertEquals(pool.checkout(), None)
+        connection = Mock(closed=False)
+        pooled = pool.add(connection)
+        self.assertRaises(PoolTimeout, pool.checkout)
+        pool.checkin(pooled)
+        self.assertEquals(pool.checkout(), pooled)
+        pool.checkin(pooled)
+        # a connection that was idle for long is checked before it's reused
+        pooled.used_at -= 60
+        connection.cursor.side_effect = Exception('server closed the connection')
+        self.assertEquals(pool.checkout(), None)
+        connection.close.assert_called_once_with()
+        stats = pool.stats()
+        self.assertEquals((stats['reused'], stats['timeouts'], stats['in_use']),
+                          (1, 1, 1))
+        # the idle ones are closed before the test database is dropped
+        pooled = pool.add(Mock(closed=False))
+        pool.checkin(pooled)
+        pool.close_idle()
+        pooled.connection.close.assert_called_once_with()
+        self.assertEquals(pool.stats()['idle'], 0)
+
+    def test_cached_id_list(self):
+        from .caching import CachedIdList
+        other = Question.objects.create(author=self.common_user,
+                        subject="when?", entity=self.home)
+        # only the first id is cached, the rest come from the queryset
+        cached = CachedIdList([self.q.id], Question.objects.order_by('id'), 2)
+        self.assertEquals(len(cached), 2)
+        self.assertEquals(cached[0:1], [self.q])
+        self.assertEquals(cached[0:2], [self.q, other])
+        self.assertEquals(cached[1], other)
+        response = Client().get(reverse('entity_home', args=(self.home.id, )),
+                                {'list': 'no such list'})
+        self.assertEquals(response.status_code, 302)
 
     def test_repr(self):
         self.assertEqual("why?", unicode(self.q))
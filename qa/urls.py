@@ -1,6 +1,5 @@
 from django.conf.urls.defaults import patterns, url
 from .views import *
-from qa.sitemaps import sitemaps
 
 urlpatterns = patterns('qa.views',
     url(r'^(?P<entity_id>[-\d]+)/qna/$', 'entity_home', name='entity_home'),
@@ -29,15 +28,9 @@ urlpatterns = patterns('qa.views',
 )
 
 urlpatterns += patterns('',
-    (r'^sitemap\.xml$',
-        'django.contrib.sitemaps.views.index',
-        {'sitemaps': sitemaps}
-    ),
-
-    (r'^sitemap-(?P<section>.+)\.xml$',
-        'django.contrib.sitemaps.views.sitemap',
-        {'sitemaps': sitemaps}
-    ),
+    url(r'^sitemap\.xml$', 'qa.sitemaps.index', name='sitemap'),
+    url(r'^sitemap-(?P<section>.+)\.xml$', 'qa.sitemaps.sitemap',
+        name='sitemap_section'),
 
     url(r'^qna/rss/$',
         RssQuestionFeed(),
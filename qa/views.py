@@ -1,12 +1,13 @@
-import os, sys
+import sys
 import json
 
-from django.db.models import Count
+from django.db import IntegrityError
 from django.http import HttpResponse, HttpResponseForbidden
 from django.http import HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404, render_to_response
 from django.http import Http404
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, condition
+from django.utils.decorators import method_decorator
 from django.template.context import RequestContext
 from django.contrib.auth.decorators import login_required
 from django.utils.translation import ugettext as _
@@ -17,15 +18,19 @@ from django.conf import settings
 from django.views.generic.detail import SingleObjectTemplateResponseMixin, BaseDetailView
 from django.core.urlresolvers import reverse
 from django.contrib.sites.models import Site
-from django.core.cache import cache
 
 from entities.models import Entity
 from taggit.models import Tag
 from actstream import follow, unfollow
 
-from user.models import Profile, Membership
+from user.models import Membership
 from qa.forms import AnswerForm, QuestionForm
 from qa.models import *
+from qa.caching import entity_fragment, question_version, fragment_version,\
+        cache_time, CachedIdList
+from qa.pagination import KEYSETS, keyset_page
+from qa.conditional import ConditionalFeed, latest_update, entity_home_etag,\
+    question_detail_etag
 from qa.tasks import publish_question_to_facebook, publish_upvote_to_facebook,\
     publish_answer
 from qa.mixins import JSONResponseMixin
@@ -34,11 +39,9 @@ from polyorg.models import CandidateList
 
 # the order options for the list views
 ORDER_OPTIONS = {'date': '-created_at', 'rating': '-rating', 'flagcount': '-flags_count'}
-# CBS locality stats
-CBS_STATS = json.load(open(os.path.join(settings.STATICFILES_ROOT, 'js/entity_stats.js')))
 
 def need_editors(entity):
-   return entity and Membership.objects.filter(entity=entity).count() < settings.MIN_EDITORS_PER_LOCALITY
+   return entity and EntityStats.for_entity(entity).users_count < settings.MIN_EDITORS_PER_LOCALITY
 
 class JsonpResponse(HttpResponse):
     def __init__(self, data, callback, *args, **kwargs):
@@ -49,15 +52,12 @@ class JsonpResponse(HttpResponse):
             *args, **kwargs)
 
 
+@condition(etag_func=entity_home_etag)
 def entity_home(request, entity_slug=None, entity_id=None, tags=None,
         template="qa/question_list.html"):
     """
     A home page for an entity including questions and candidates
     """
-    if request.user.is_anonymous() and not tags and not request.GET:
-        ret = cache.get(entity_home_key(entity_id))
-        if ret:
-            return ret
     context = RequestContext(request)
     entity = context.get('entity', None)
     if not entity:
@@ -88,43 +88,78 @@ def entity_home(request, entity_slug=None, entity_id=None, tags=None,
     else:
         current_tags = None
 
-    if entity:
-        tags = Tag.objects.filter(qa_taggedquestion_items__content_object__entity=entity,\
-            qa_taggedquestion_items__content_object__is_deleted=False).\
-                annotate(num_times=Count('qa_taggedquestion_items')).\
-                order_by("-num_times","slug")
-        users_count = Membership.objects.filter(entity=entity).count()
+    # the cursor mode pages by keys instead of offsets, see `qa.pagination`
+    cursor = request.GET.get('cursor')
+    next_cursor = None
+    if request.GET.get('format') == 'json':
+        # the answers aren't serialized
+        questions, next_cursor = keyset_page(questions.prefetch_related(None),
+                order_opt if order_opt in KEYSETS else 'rating', cursor)
+        return HttpResponse(json.dumps({
+                'questions': [{
+                    'id': q.id,
+                    'subject': q.subject,
+                    'url': q.get_absolute_url(),
+                    'author': q.author.username,
+                    'rating': q.rating,
+                    'created_at': q.created_at.isoformat(),
+                } for q in questions],
+                'next': next_cursor,
+            }), content_type='application/json')
+    elif cursor is not None and order_opt in KEYSETS:
+        questions, next_cursor = keyset_page(questions, order_opt, cursor)
+        if next_cursor:
+            # the next page keeps the rest of the query, e.g. the list
+            next_query = request.GET.copy()
+            next_query['cursor'] = next_cursor
+            context['next_query'] = next_query.urlencode()
     else:
-        users_count = Profile.objects.count()
-
+        cursor = None
+        if not tags and not only_flagged:
+            # the first pages of the plain lists are cached as ids, only a
+            # page is loaded
+            question_ids, count = entity_fragment(entity.id,
+                    'question_ids_%s' % order,
+                    lambda: (list(questions.values_list('id', flat=True)\
+                                [:settings.CACHED_QUESTION_IDS]),
+                             questions.count()))
+            questions = CachedIdList(question_ids, questions, count)
+
+    tags = entity_fragment(entity.id, 'tags', lambda: EntityTag.cloud(entity.id))
+
+    entity_stats = EntityStats.for_entity(entity)
+
+    # the leaderboard, ordered by the answer counts kept in `qa.leaderboard`
     memberships = entity.membership_set.filter(can_answer=True)
-    candidate_lists_ids = memberships.values_list('member_of', flat=True).distinct()
-    candidate_lists = CandidateList.objects.filter(pk=candidate_lists_ids)
+    candidate_lists_ids = entity_fragment(entity.id, 'candidate_lists',
+            lambda: list(CandidateList.objects.\
+                filter(pk__in=memberships.values_list('member_of', flat=True)).\
+                order_by('-answers_count', 'id').values_list('id', flat=True)))
+    candidate_lists = CachedIdList(candidate_lists_ids, CandidateList.objects.all())
 
     list_id = request.GET.get('list', default='special')
     if list_id == 'special':
         candidate_list = None
-        candidate_ids = memberships.filter(is_special=True).values_list('user', flat=True)
+        candidate_memberships = memberships.filter(is_special=True)
     else:
         try:
-            candidate_list = candidate_lists.get(pk=list_id)
-        except (CandidateList.DoesNotExist, ValueError):
-            messages.error(request, _('No such candidate list: ' + list_id))
+            # the id is part of a cache key
+            list_id = int(list_id)
+            candidate_list = candidate_lists[candidate_lists_ids.index(list_id)]
+        except ValueError:
+            messages.error(request, _('No such candidate list: %s') %
+                           request.GET['list'])
             return HttpResponseRedirect(request.path)
-        candidate_ids = memberships.filter(member_of=candidate_list).values_list('user', flat=True)
-
-    candidates = User.objects.filter(id=candidate_ids)
-    candidates = candidates.annotate(num_answers=models.Count('answers')).\
-                            order_by('-num_answers')
+        candidate_memberships = memberships.filter(member_of=candidate_list)
 
-    candidate_lists = candidate_lists.annotate( \
-                            num_answers=models.Count('candidates__answers')).\
-                            order_by('-num_answers')
+    candidates = CachedIdList(entity_fragment(entity.id,
+                'candidates_%s' % list_id,
+                lambda: list(candidate_memberships.\
+                    order_by('-answers_count', 'id').values_list('id', flat=True))),
+                Membership.objects.select_related('user', 'member_of'))
     candidate_list = None
 
-    answers_count = Answer.objects.filter(question__entity=entity, question__is_deleted=False).count()
-    
-    stats = CBS_STATS.get(entity.code, {"totalpopulation": 0, "numofcouncilman": "", "socioeco": "", "voting":""})
+    stats = LocalityStats.for_code(entity.code)
 
     context.update({ 'tags': tags,
         'questions': questions,
@@ -132,19 +167,21 @@ def entity_home(request, entity_slug=None, entity_id=None, tags=None,
         'by_rating': order_opt == 'rating',
         'only_flagged': only_flagged,
         'current_tags': current_tags,
-        'need_editors': need_editors(entity),
+        'cursor_mode': cursor is not None,
+        'next_cursor': next_cursor,
+        'need_editors': entity_stats.users_count < settings.MIN_EDITORS_PER_LOCALITY,
         'candidates': candidates,
         'candidate_list': candidate_list,
         'candidate_lists': candidate_lists,
-        'users_count': users_count,
-        'answers_count': answers_count,
+        'entity_stats': entity_stats,
+        'users_count': entity_stats.users_count,
+        'answers_count': entity_stats.answers_count,
         'stats': stats,
+        'upvoted_ids': upvoted_question_ids(request.user,
+                                            question__entity=entity),
         })
 
-    ret = render(request, template, context)
-    if request.user.is_anonymous() and not tags and not request.GET:
-        cache.set('entity_home_%s' % entity_id, ret, timeout = 36000)
-    return ret
+    return render(request, template, context)
 
 class QuestionDetail(JSONResponseMixin, SingleObjectTemplateResponseMixin, BaseDetailView):
     model = Question
@@ -152,18 +189,30 @@ class QuestionDetail(JSONResponseMixin, SingleObjectTemplateResponseMixin, BaseD
     context_object_name = 'question'
     slug_field = 'unislug'
 
+    @method_decorator(condition(etag_func=question_detail_etag))
+    def dispatch(self, *args, **kwargs):
+        return super(QuestionDetail, self).dispatch(*args, **kwargs)
+
     def get_queryset(self, queryset=None):
+        questions = Question.objects.select_related('author', 'entity')
         if 'entity_id' in self.kwargs:
-            return Question.objects.filter(entity__id=self.kwargs['entity_id'])
+            return questions.filter(entity__id=self.kwargs['entity_id'])
         elif 'entity_slug' in self.kwargs:
-            return Question.objects.filter(entity__slug=self.kwargs['entity_slug'])
+            return questions.filter(entity__slug=self.kwargs['entity_slug'])
 
     def get_context_data(self, **kwargs):
         user = self.request.user
         question = self.object
         context = super(QuestionDetail, self).get_context_data(**kwargs)
         context['max_length_a_content'] = MAX_LENGTH_A_CONTENT
-        context['answers'] = question.answers.filter(is_deleted=False)
+        # the answers and supporters are rendered in cached fragments, these
+        # querysets are only evaluated when the question's version changes
+        context['answers'] = question.answers.filter(is_deleted=False).\
+                select_related('author').\
+                prefetch_related('author__candidate_set__candidate_list')
+        context['question_version'] = fragment_version(
+                                            question_version(question.id))
+        context['cache_time'] = cache_time()
         context['entity'] = question.entity
         can_answer = question.can_answer(user)
         context['can_answer'] = can_answer
@@ -175,17 +224,25 @@ class QuestionDetail(JSONResponseMixin, SingleObjectTemplateResponseMixin, BaseD
             except question.answers.model.DoesNotExist:
                 context['my_answer_form'] = AnswerForm()
         context['can_flag'] = True
+        upvoted_ids = upvoted_question_ids(user, question=question)
+        context['upvoted_ids'] = upvoted_ids
         if 'answer' in self.request.GET:
             try:
-                answer = Answer.objects.get(pk=self.request.GET['answer'])
-                context['fb_message'] = answer.content
-            except:
+                context['fb_message'] = question.answers.values_list('content',
+                        flat=True).get(pk=self.request.GET['answer'])
+            except (ValueError, Answer.DoesNotExist):
                 pass
 
-        supporters = [vote.user for vote in question.upvotes.all()]
-        supporters = [question.author] + supporters
-        if user in supporters and user != question.author:
-            supporters = [user] + [u for u in supporters if u != user]
+        # a supporter sees himself first
+        if question.id in upvoted_ids and user != question.author:
+            context['supporter_first'] = user.id
+        def supporters():
+            upvoters = [vote.user for vote in
+                        question.upvotes.select_related('user')]
+            supporters = [question.author] + upvoters
+            if 'supporter_first' in context:
+                supporters = [user] + [u for u in supporters if u != user]
+            return supporters
         context['supporters'] = supporters
 
         return context
@@ -225,7 +282,7 @@ def post_answer(request, q_id):
     answer.content = request.POST.get("content")
 
     answer.save()
-    publish_answer.delay(answer, send_email=is_new_answer)
+    publish_answer.delay(answer.id, send_email=is_new_answer)
 
     return HttpResponseRedirect(question.get_absolute_url())
 
@@ -266,7 +323,7 @@ def post_question(request, entity_id, slug=None):
             question.save()
             form.save_m2m()
             if form.cleaned_data.get('facebook_publish', False):
-                publish_question_to_facebook.delay(question)
+                publish_question_to_facebook.delay(question.id)
             follow(request.user, question)
             return HttpResponseRedirect(question.get_absolute_url())
     else:
@@ -301,12 +358,13 @@ def upvote_question(request, q_id):
         if user.upvotes.filter(question=q):
             return HttpResponseForbidden(_("You already upvoted this question"))
         else:
-            upvote = QuestionUpvote.objects.create(question=q, user=user)
-            #TODO: use signals so the next line won't be necesary
-            new_count = change_rating(q, 1)
+            try:
+                upvote, new_count = add_upvote(q, user)
+            except IntegrityError: # a concurrent request beat us to it
+                return HttpResponseForbidden(_("You already upvoted this question"))
             follow(request.user, q)
 
-            publish_upvote_to_facebook.delay(upvote)
+            publish_upvote_to_facebook.delay(upvote.id)
             return HttpResponse(new_count)
     else:
         return HttpResponseForbidden(_("Use POST to upvote a question"))
@@ -318,11 +376,10 @@ def downvote_question(request, q_id):
         user = request.user
         if q.author == user:
             return HttpResponseForbidden(_("Cannot downvote your own question"))
-        elif not user.upvotes.filter(question=q):
+        new_count = remove_upvote(q, user)
+        if new_count is None:
             return HttpResponseForbidden(_("You already downvoted this question"))
         else:
-            QuestionUpvote.objects.filter(question=q, user=user).delete()
-            new_count = change_rating(q, -1)
             unfollow(request.user, q)
 
             # TODO: publish_downvote_to_facebook.delay(upvote)
@@ -332,11 +389,23 @@ def downvote_question(request, q_id):
 
 
 @transaction.commit_on_success
+def add_upvote(q, user):
+    ''' returns the new upvote and rating. raises `IntegrityError` if the
+        user already upvoted the question '''
+    upvote = QuestionUpvote.objects.create(question=q, user=user)
+    return upvote, change_rating(q, 1)
+
+@transaction.commit_on_success
+def remove_upvote(q, user):
+    ''' returns the new rating, or None if the user has no upvote to remove '''
+    upvotes = QuestionUpvote.objects.select_for_update().filter(question=q, user=user)
+    if not upvotes:
+        return None
+    upvotes.delete()
+    return change_rating(q, -1)
+
 def change_rating(q, change):
-    q = Question.objects.get(id=q.id)
-    q.rating += change
-    q.save()
-    return q.rating
+    return q.change_counter('rating', change)
 
 
 class RssQuestionFeed(Feed):
@@ -355,11 +424,36 @@ class RssQuestionFeed(Feed):
         return item.content
 
 
-class AtomQuestionFeed(Feed):
-    feed_type = Atom1Feed
+class PagedAtom1Feed(Atom1Feed):
+    ''' an atom feed that links to its next page '''
+    def add_root_elements(self, handler):
+        super(PagedAtom1Feed, self).add_root_elements(handler)
+        if self.feed.get('next_link'):
+            handler.addQuickElement(u"link", "",
+                    {u"rel": u"next", u"href": self.feed['next_link']})
+
+
+class AtomQuestionFeed(ConditionalFeed):
+    feed_type = PagedAtom1Feed
+    page_size = 30
+
+    def last_modified(self, request, entity_id):
+        # deleted questions are updated as they leave the feed
+        return latest_update(Question.objects.filter(entity=entity_id))
 
     def get_object(self, request, entity_id):
-        return get_object_or_404(Entity, pk=entity_id)
+        entity = get_object_or_404(Entity, pk=entity_id)
+        # the feed is shared by all the requests, so the page is kept on the entity
+        questions = Question.objects.filter(is_deleted=False, entity=entity).\
+                        select_related('author', 'entity')
+        entity.questions_page, next_cursor = keyset_page(questions, 'date',
+                request.GET.get('cursor'), self.page_size)
+        entity.next_link = next_cursor and \
+                request.build_absolute_uri('?cursor=%s' % next_cursor)
+        return entity
+
+    def feed_extra_kwargs(self, obj):
+        return {'next_link': obj.next_link}
 
     def title(self, obj):
         return _("Questions feed for %s") % unicode(obj)
@@ -379,11 +473,17 @@ class AtomQuestionFeed(Feed):
     item_description = item_subtitle
 
     def items(self, obj):
-        return Question.objects.filter(is_deleted=False, entity=obj).order_by('-created_at')[:30]
+        return obj.questions_page
 
-class RssQuestionAnswerFeed(Feed):
+class RssQuestionAnswerFeed(ConditionalFeed):
     """"Give question, get all answers for that question"""
 
+    def last_modified(self, request, q_id):
+        updates = filter(None, [
+                latest_update(Question.objects.filter(pk=q_id)),
+                latest_update(Answer.objects.filter(question=q_id))])
+        return max(updates) if updates else None
+
     def get_object(self, request, q_id):
         return get_object_or_404(Question, pk=q_id)
 
@@ -0,0 +1,53 @@
+''' helpers for importing users in bulk '''
+import itertools
+from multiprocessing import Pool
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from user.models import Profile
+from qa.models import EntityStats
+from qa.caching import bump_entity_version
+
+def chunked(iterable, size):
+    ''' yields lists of up to `size` items from `iterable` '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def hash_passwords(passwords, processes=None):
+    ''' hashes `passwords` across a pool of `processes` workers (default: a
+        worker per core), returns the hashes in the same order '''
+    passwords = [unicode(p) for p in passwords]
+    if processes == 1 or len(passwords) < 2:
+        return map(make_password, passwords)
+    pool = Pool(processes)
+    try:
+        return pool.map(make_password, passwords)
+    finally:
+        pool.close()
+        pool.join()
+
+def bulk_create_users(users, batch_size=500, **profile_fields):
+    ''' inserts the unsaved `users` and their profiles, with `profile_fields`.
+
+        `bulk_create` doesn't send `post_save`, so the profiles
+        `create_profile` would have made are inserted here as well.
+        returns a {username: user id} map.
+    '''
+    User.objects.bulk_create(users, batch_size)
+    ids = dict(User.objects.filter(username__in=[u.username for u in users]).\
+                values_list('username', 'id'))
+    Profile.objects.bulk_create([Profile(user_id=ids[u.username], **profile_fields)
+                                    for u in users], batch_size)
+    return ids
+
+def refresh_entities(entity_ids):
+    ''' recounts the members of the entities and invalidates their cached
+        pages, the bulk inserts skip the signals that keep them up to date '''
+    for entity_id in entity_ids:
+        EntityStats.recount(entity_id, 'users_count')
+        bump_entity_version(entity_id)
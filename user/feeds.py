@@ -1,13 +1,16 @@
 from django.shortcuts import get_object_or_404
 from django.utils.feedgenerator import Atom1Feed
 from django.utils.translation import ugettext as _
-from django.contrib.syndication.views import Feed
 from django.contrib.auth.models import User
 from qa.models import Answer
+from qa.conditional import ConditionalFeed, latest_update
 
-class RssUserAnswerFeed(Feed):
+class RssUserAnswerFeed(ConditionalFeed):
     """"Give candidate, get all answers for that candidate"""
 
+    def last_modified(self, request, candidate_id):
+        return latest_update(Answer.objects.filter(author=candidate_id))
+
     def get_object(self, request, candidate_id):
         return get_object_or_404(User, pk=candidate_id)
 
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
+import time
+from optparse import make_option
+
 from django.core.management.base import BaseCommand
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 
-from user.models import User
+from user.models import User, Membership
+from user.bulk import chunked, hash_passwords, bulk_create_users,\
+    refresh_entities
 from entities.models import Entity
 
 import ucsv as csv
@@ -11,37 +16,76 @@ import ucsv as csv
 class Command(BaseCommand):
     args = '<members_file>'
     help = 'import members from a csv file'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=500,
+            help='number of rows to insert at once'),
+        make_option('--processes', type='int', dest='processes', default=None,
+            help='number of processes hashing the passwords, default is a process per core'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='check the file and report, without saving anything'),
+    )
 
+    @transaction.commit_on_success
     def handle(self, *args, **options):
+        start = time.time()
+        dry_run = options['dry_run']
         file_name = args[0]
         f = open(file_name, 'rb')
         d = csv.DictReader(f)
-        for row in d:
-            username = row['username']
-
-            if User.objects.filter(username=username).exists():
-                print 'User %s exists.' % (username)
-            else:
-                first_name = row.get('first_name', '')
-                last_name = row.get('last_name', '')
-                email = row.get('email', '')
-                locality = row.get('locality', '')
-                gender = row.get('gender', '')
-                password = row.get('password', '')
-
-                user = User(
-                    username=username,
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name,
-                )
 
-                user.set_password(password)
-                user.save()
+        existing = set(User.objects.values_list('username', flat=True))
+        localities = set(Entity.objects.values_list('id', flat=True))
+        added = skipped = 0
+        entity_ids = set()
+        for rows in chunked(d, options['batch_size']):
+            users, members = [], []
+            for row in rows:
+                username = unicode(row['username'])
+                if username in existing:
+                    print 'User %s exists.' % (username)
+                    skipped += 1
+                    continue
+                existing.add(username)
 
-                user.profile.gender = gender
+                locality = row.get('locality', '')
                 try:
-                    user.add_entity(Entity.objects.get(id=locality))
-                except ObjectDoesNotExist:
+                    locality = int(locality)
+                except ValueError:
+                    pass
+                if locality in localities:
+                    entity_ids.add(locality)
+                else:
                     print 'user %s locality id %s does not exist' % (username, locality)
-                user.profile.save()
+                    locality = None
+                members.append((username, row.get('gender', ''), locality))
+                users.append(User(
+                    username=username,
+                    email=row.get('email', ''),
+                    first_name=row.get('first_name', ''),
+                    last_name=row.get('last_name', ''),
+                    password=row.get('password', ''),
+                ))
+
+            added += len(users)
+            if not dry_run and users:
+                for user, hashed in zip(users,
+                        hash_passwords([u.password for u in users], options['processes'])):
+                    user.password = hashed
+                # the profile fields are shared by a bulk insert, so insert per gender
+                genders = dict((name, gender) for name, gender, entity_id in members)
+                by_gender = {}
+                for user in users:
+                    by_gender.setdefault(genders[user.username], []).append(user)
+                user_ids = {}
+                for gender, group in by_gender.items():
+                    user_ids.update(bulk_create_users(group, gender=gender or None))
+                Membership.objects.bulk_create([Membership(user_id=user_ids[name],
+                        entity_id=entity_id)
+                    for name, gender, entity_id in members if entity_id])
+            self.stdout.write('> %d users %s, %d skipped, %.0f rows/second\n' % \
+                    (added, 'checked' if dry_run else 'added', skipped,
+                     (added + skipped) / (time.time() - start)))
+
+        if dry_run:
+            return
+        refresh_entities(entity_ids)
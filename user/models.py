@@ -57,53 +57,67 @@ class Profile(models.Model):
     def get_full_name(self):
         return self.user.get_full_name() or self.user.username
 
+    @property
+    def memberships(self):
+        ''' a map of entity ids to the user's `Membership` objects.
+
+            loaded with a single query and kept on the profile, so the
+            permission helpers below cost one query per request no matter
+            how many times the templates call them '''
+        try:
+            return self._memberships
+        except AttributeError:
+            self._memberships = dict((m.entity_id, m) for m in
+                    self.user.membership_set.select_related('entity__division',
+                                                            'member_of'))
+            return self._memberships
+
+    def reset_memberships(self):
+        ''' drop the cached memberships, call after changing them '''
+        self.__dict__.pop('_memberships', None)
+        self.__dict__.pop('locality', None)
+
+    def get_membership(self, entity):
+        return self.memberships.get(getattr(entity, 'pk', entity))
+
     def is_member_of(self, entity):
-        return self.user.membership_set.filter(entity=entity).exists()
+        return self.get_membership(entity) is not None
 
     def get_entity_ids(self, is_editor=None, can_answer=None):
-        memberships = self.user.membership_set
+        memberships = self.memberships.values()
         if is_editor:
-            memberships = memberships.filter(is_editor=is_editor)
+            memberships = [m for m in memberships if m.is_editor == is_editor]
         if can_answer:
-            memberships = memberships.filter(can_answer=can_answer)
-        return memberships.values_list('entity', flat=True)
+            memberships = [m for m in memberships if m.can_answer == can_answer]
+        return [m.entity_id for m in memberships]
 
     @property
-    def entities(self, is_editor=None, can_answer=None):
-        return Entity.filter(id=get_entity_ids(is_editor, can_answer))
+    def entities(self):
+        return Entity.objects.filter(id__in=self.get_entity_ids())
 
     @property
     def editor_in(self):
-        return self.entities(is_editor=True)
+        return Entity.objects.filter(id__in=self.get_entity_ids(is_editor=True))
 
     @property
     def candidate_in(self):
-        return self.entities(can_answer=True)
+        return Entity.objects.filter(id__in=self.get_entity_ids(can_answer=True))
 
     def can_answer(self, entity):
-        try:
-            return Membership.objects.get(user=self.user, entity=entity).can_answer
-        except Membership.DoesNotExist:
-            return False
+        membership = self.get_membership(entity)
+        return membership.can_answer if membership else False
 
     def is_editor(self, entity):
-        try:
-            return Membership.objects.get(user=self.user, entity=entity).is_editor
-        except Membership.DoesNotExist:
-            return False
+        membership = self.get_membership(entity)
+        return membership.is_editor if membership else False
 
     def is_special(self, entity):
-        try:
-            return Membership.objects.get(user=self.user, entity=entity).is_special
-        except Membership.DoesNotExist:
-            return False
+        membership = self.get_membership(entity)
+        return membership.is_special if membership else False
 
     def candidate_list(self, entity):
-        try:
-            membership = Membership.objects.get(user=self.user, entity=entity)
-            return CandidateList.get(membership_set__in=membership)
-        except Membership.DoesNotExist:
-            return None
+        membership = self.get_membership(entity)
+        return membership.member_of if membership else None
 
     def candidate_lists(self):
         membership = Membership.objects.filter(user=self.user)
@@ -111,22 +125,22 @@ class Profile(models.Model):
 
     @cached_property
     def locality(self):
-        try:
-            return self.user.membership_set.get(entity__division__index=3).entity
-        except Membership.DoesNotExist: # does not have a locality set
+        localities = [m for m in self.memberships.values()
+                        if m.entity.division.index == 3]
+        if not localities: # does not have a locality set
             return None
-        except Membership.MultipleObjectsReturned, e: # does not have a locality set
+        if len(localities) > 1:
             raise Membership.MultipleObjectsReturned("%s has multiple localities: %s" \
-                    % (self.user, \
-                    self.user.membership_set.filter(entity__division__index=3).\
-                    values_list('entity__name', flat=True)), \
-                    e)
+                    % (self.user, [m.entity.name for m in localities]))
+        return localities[0].entity
 
     def add_entity(self, entity, is_editor=False):
         Membership.objects.create(user=self.user, entity=entity, is_editor=is_editor)
+        self.reset_memberships()
 
     def remove_entity(self, entity):
         self.user.membership_set.get(entity=entity).delete()
+        self.reset_memberships()
 
     def set_locality(self, entity, is_editor=False):
         if entity.division.index != 3:
@@ -144,3 +158,8 @@ class Membership(models.Model):
     is_special = models.BooleanField(default=False)
     can_answer = models.BooleanField(default=False)
     member_of = models.ForeignKey(CandidateList, null=True, blank=True)
+    # maintained by `qa.leaderboard`
+    answers_count = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = [('user', 'entity')]
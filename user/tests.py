@@ -1,8 +1,10 @@
 from django.contrib.auth.models import User
 from django.test.client import Client
 from django.core.urlresolvers import reverse
+from django.core.management import call_command
 
 from django.test import TestCase
+import tempfile
 
 from entities.models import Domain, Division, Entity
 from .models import *
@@ -67,3 +69,40 @@ class UserTest(TestCase):
         self.user.profile.add_entity(locality)
         self.assertTrue(self.user.profile.is_member_of(locality))
         self.assertTrue(locality.id in self.user.profile.get_entity_ids())
+
+    def test_memberships_cache(self):
+        domain = Domain.objects.create(name="test")
+        division = Division.objects.create(name="localities", domain=domain,
+                index=3)
+        locality = Entity.objects.create(name="the moon", division=division)
+        profile = self.user.profile
+        profile.set_locality(locality, is_editor=True)
+        with self.assertNumQueries(1):
+            self.assertTrue(profile.is_member_of(locality))
+            self.assertTrue(profile.is_editor(locality))
+            self.assertFalse(profile.can_answer(locality))
+            self.assertFalse(profile.is_special(locality))
+            self.assertEquals(profile.locality, locality)
+        profile.remove_entity(locality)
+        self.assertFalse(profile.is_member_of(locality))
+        self.assertEquals(profile.locality, None)
+
+    def test_add_users(self):
+        domain = Domain.objects.create(name="test")
+        division = Division.objects.create(name="localities", domain=domain,
+                index=3)
+        locality = Entity.objects.create(name="the moon", division=division)
+        csv_file = tempfile.NamedTemporaryFile()
+        csv_file.write("username,first_name,last_name,email,locality,gender,password\n"
+                       "neil,Neil,Armstrong,neil@example.com,%d,M,eagle\n"
+                       "sally,Sally,Ride,,%d,F,challenger\n"
+                       "%s,,,,,,\n" % (locality.id, locality.id, self.user.username))
+        csv_file.flush()
+        call_command('add_users', csv_file.name, processes=1, dry_run=True)
+        self.assertFalse(User.objects.filter(username="neil").exists())
+        call_command('add_users', csv_file.name, processes=1)
+        neil = User.objects.get(username="neil")
+        self.assertTrue(neil.check_password("eagle"))
+        self.assertEquals(neil.profile.gender, "M")
+        self.assertEquals(neil.profile.locality, locality)
+        self.assertEquals(User.objects.get(username="sally").profile.gender, "F")